@@ -1,6 +1,10 @@
 ﻿import os
 import sys
-from flask import Flask, request, jsonify
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import base64
 
@@ -16,6 +20,83 @@ print(f"🚀 运行环境: {'Render' if is_render else '本地'}")
 # YOLO服务状态
 yolo_available = False
 yolo_detector = None
+inference_queue = None
+result_cache = None
+duplicate_index = None
+job_runner = None
+health_history = None
+trend_store = None
+rollup_store = None
+batch_executor = None
+admission = None
+quality_gate = None
+record_writer = None
+# 模型在后台线程中加载并预热，完成后才对外报告就绪
+model_ready = threading.Event()
+warmup_info = {"status": "pending", "timings_ms": {}, "seconds": None, "load_seconds": None, "error": None}
+
+# 预热配置: 需要预热的输入尺寸（逗号分隔）
+YOLO_WARMUP_SIZES = [int(size) for size in os.environ.get('YOLO_WARMUP_SIZES', '640').split(',') if size.strip()]
+
+# 批处理推理配置
+YOLO_BATCH_SIZE = int(os.environ.get('YOLO_BATCH_SIZE', 8))
+YOLO_BATCH_TIMEOUT_MS = float(os.environ.get('YOLO_BATCH_TIMEOUT_MS', 20))
+
+# 结果缓存配置 (YOLO_CACHE_SIZE=0 关闭缓存，YOLO_CACHE_PATH 为空时只缓存在内存中)
+YOLO_CACHE_SIZE = int(os.environ.get('YOLO_CACHE_SIZE', 256))
+YOLO_CACHE_TTL = float(os.environ.get('YOLO_CACHE_TTL', 3600))
+YOLO_CACHE_PATH = os.environ.get('YOLO_CACHE_PATH') or None
+
+# 近似重复检测配置 (YOLO_DEDUP_DISTANCE<0 关闭)
+YOLO_DEDUP_DISTANCE = int(os.environ.get('YOLO_DEDUP_DISTANCE', 4))
+YOLO_DEDUP_WINDOW = float(os.environ.get('YOLO_DEDUP_WINDOW', 120))
+# 平均颜色 (HSV, 0-255) 相差超过该值时不复用结果
+YOLO_DEDUP_COLOR_DISTANCE = float(os.environ.get('YOLO_DEDUP_COLOR_DISTANCE', 12))
+
+# 异步任务配置: 同时执行的任务数、排队上限、长轮询最长等待秒数
+YOLO_JOB_WORKERS = int(os.environ.get('YOLO_JOB_WORKERS', 2))
+YOLO_JOB_QUEUE_SIZE = int(os.environ.get('YOLO_JOB_QUEUE_SIZE', 64))
+JOB_MAX_WAIT = 30
+
+# 批量分析配置: 每个请求最多图像数、请求体总大小上限(MB)、并行解码线程数（不少于批大小才能凑满批次）
+YOLO_BATCH_MAX_IMAGES = int(os.environ.get('YOLO_BATCH_MAX_IMAGES', 100))
+MAX_BATCH_BYTES = int(float(os.environ.get('YOLO_BATCH_MAX_MB', 64)) * 1024 * 1024)
+YOLO_DECODE_WORKERS = int(os.environ.get('YOLO_DECODE_WORKERS', max(YOLO_BATCH_SIZE, 1) * 2))
+
+# 独立推理进程配置: 进程数（0 = 在Web进程内推理）、每个进程处理多少张图像后重启（0 = 不重启）
+YOLO_INFERENCE_PROCESSES = int(os.environ.get('YOLO_INFERENCE_PROCESSES', 0))
+YOLO_WORKER_MAX_TASKS = int(os.environ.get('YOLO_WORKER_MAX_TASKS', 0))
+
+# 准入控制: 同时等待/执行推理的请求上限、每个请求的截止时间，过载时是否降级为图像特征分析
+YOLO_MAX_PENDING = int(os.environ.get('YOLO_MAX_PENDING', max(YOLO_BATCH_SIZE, 1) * 4))
+YOLO_DEADLINE_MS = float(os.environ.get('YOLO_DEADLINE_MS', 10000))
+YOLO_DEGRADE_ON_OVERLOAD = os.environ.get('YOLO_DEGRADE_ON_OVERLOAD', '0') == '1'
+
+# 推理前的图像质量检查，默认关闭 (YOLO_QUALITY_GATE=1 开启，不合格返回422)：阈值需按真实照片调好，
+# 且前端要能处理 retake_photo 提示；YOLO_MIN_SHARPNESS 为拉普拉斯方差的模糊阈值
+YOLO_QUALITY_GATE = os.environ.get('YOLO_QUALITY_GATE', '0') == '1'
+YOLO_MIN_SHARPNESS = float(os.environ.get('YOLO_MIN_SHARPNESS', 15))
+
+# 分析结果写入 cathealth.db 的 health_records 表: 写入队列上限、每个事务最多条数、最长攒批时间
+HEALTH_RECORD_QUEUE_SIZE = int(os.environ.get('HEALTH_RECORD_QUEUE_SIZE', 1000))
+HEALTH_RECORD_BATCH_SIZE = int(os.environ.get('HEALTH_RECORD_BATCH_SIZE', 100))
+HEALTH_RECORD_FLUSH_MS = float(os.environ.get('HEALTH_RECORD_FLUSH_MS', 500))
+
+# 上传大小上限（图像原始字节，JSON中的base64按编码后约4/3倍计算）
+MAX_UPLOAD_BYTES = int(float(os.environ.get('YOLO_MAX_UPLOAD_MB', 10)) * 1024 * 1024)
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# multipart 边界、表单字段等额外开销
+MULTIPART_OVERHEAD = 16 * 1024
+
+# 503响应提示客户端多少秒后重试
+RETRY_AFTER_HEADERS = {'Retry-After': '5'}
+
+# Gunicorn预加载模式（由 gunicorn.conf.py 设置）：主进程只加载权重，线程和连接在每个worker里创建
+PREFORK = os.environ.get('CATHEALTH_PREFORK') == '1'
+
+# `python app.py` 启动时，推理进程 (spawn) 会把本文件重新导入为 __mp_main__；
+# 这时只需要模块中的定义，不能再创建推理进程池、任务线程池或清理任务表
+SPAWNED_CHILD = __name__ == '__mp_main__'
 
 if is_render:
     # Render环境 - 尝试加载YOLO
@@ -32,16 +113,14 @@ if is_render:
         model_path = os.path.join(backend_dir, "models", "best.pt")
         if os.path.exists(model_path):
             print(f" 找到模型文件: {model_path}")
-            yolo_detector = YOLODetector(model_path=model_path)
-            yolo_available = yolo_detector.model is not None
-            print(f" YOLO加载: {'成功' if yolo_available else '失败'}")
+            # 不在导入时加载ultralytics/torch，进程启动后由后台线程加载
+            yolo_detector = YOLODetector(model_path=model_path, lazy=True)
         else:
             print(f" 模型文件不存在: {model_path}")
             print(" 建议: 确保模型文件已提交到Git仓库")
             
     except Exception as e:
         print(f" YOLO初始化失败: {e}")
-        yolo_available = False
 else:
     # 本地环境
     try:
@@ -54,13 +133,170 @@ else:
         from yolo.detector import YOLODetector
         
         model_path = os.path.join(backend_dir, "models", "best.pt")
-        yolo_detector = YOLODetector(model_path=model_path)
-        yolo_available = yolo_detector.model is not None
-        print(f" 本地YOLO加载: {'成功' if yolo_available else '失败'}")
+        yolo_detector = YOLODetector(model_path=model_path, lazy=True)
         
     except Exception as e:
         print(f" 本地YOLO初始化失败: {e}")
-        yolo_available = False
+
+if yolo_detector is not None:
+    from yolo import (AdmissionController, BatchInferenceQueue, ImageQualityGate, InferenceProcessPool,
+                      NearDuplicateIndex, OverloadedError, PoorImageQualityError, ResultCache, make_cache_key)
+    from yolo.image_decode import decode_base64
+
+from memory_report import read_smaps_rollup
+# 纯函数，分析流程每次都会用到，不放在下面可能失败的任务/存储初始化中
+from storage import parse_cat_id, record_from_result
+
+def run_analysis_job(payload):
+    """在任务线程池中执行一次分析（加载/预热期间提交的任务等待完成）"""
+    model_ready.wait()
+    if not yolo_available:
+        return simulated_result()
+    result = analyze_image_bytes(payload["image_bytes"], cat_id=payload["cat_id"])
+    if result is None:
+        raise ValueError("图像解码失败")
+    return result
+
+if not SPAWNED_CHILD:
+    try:
+        # 任务状态保存在 cathealth.db 的 analysis_jobs 表
+        from storage import (HealthHistory, HealthRecordWriter, InvalidCursorError, JobRunner, JobStore,
+                             QueueFullError, RollupStore, TrendStore)
+        job_runner = JobRunner(
+            JobStore(),
+            run_analysis_job,
+            max_workers=YOLO_JOB_WORKERS,
+            max_pending=YOLO_JOB_QUEUE_SIZE
+        )
+    except Exception as e:
+        print(f" 异步任务初始化失败: {e}")
+
+    try:
+        # 历史查询: 首次启动时建立 (cat_id, created_at) 覆盖索引
+        health_history = HealthHistory()
+        # 每只猫的趋势状态随记录写入增量更新；升级后第一次启动时从 health_records 重建
+        trend_store = TrendStore()
+        trend_store.ensure_built()
+        # 仪表盘图表使用的日/周汇总表，同样随记录写入增量更新
+        rollup_store = RollupStore()
+        rollup_store.ensure_built()
+    except Exception as e:
+        print(f" 健康历史初始化失败: {e}")
+
+def warmup_model():
+    """后台加载模型并在每个配置的输入尺寸上做空推理，完成后才标记就绪"""
+    global yolo_available
+    warmup_info["status"] = "loading"
+    start = time.time()
+    try:
+        if isinstance(inference_queue, InferenceProcessPool):
+            # 模型在推理进程中加载和预热，Web进程不加载模型
+            warmup_info["status"] = "running"
+            yolo_available = inference_queue.wait_ready()
+            warmup_info["timings_ms"] = inference_queue.warmup_timings
+            warmup_info["status"] = "done" if yolo_available else "skipped"
+            print(f" 推理进程加载YOLO: {'成功' if yolo_available else '失败'}")
+        elif yolo_detector.ensure_loaded():
+            yolo_available = True
+            warmup_info["load_seconds"] = yolo_detector.load_seconds
+            print(f" YOLO加载: 成功 ({yolo_detector.load_seconds}s)")
+            warmup_info["status"] = "running"
+            warmup_info["timings_ms"] = yolo_detector.warmup(YOLO_WARMUP_SIZES, batch_size=YOLO_BATCH_SIZE)
+            warmup_info["status"] = "done"
+        else:
+            warmup_info["status"] = "skipped"
+    except Exception as e:
+        print(f" 模型预热失败: {e}")
+        warmup_info["status"] = "failed"
+        warmup_info["error"] = str(e)
+    warmup_info["seconds"] = round(time.time() - start, 2)
+    model_ready.set()
+
+def start_inference_services():
+    """
+    创建批处理队列、结果缓存等带线程/数据库连接的组件，并在后台加载、预热模型
+    普通模式在导入时调用；预加载模式由 gunicorn.conf.py 的 post_fork 在每个worker里调用
+    """
+    global inference_queue, result_cache, batch_executor, duplicate_index, admission, quality_gate, record_writer
+    if yolo_detector is None:
+        warmup_info["status"] = "skipped"
+        model_ready.set()
+        return
+    
+    if YOLO_INFERENCE_PROCESSES > 0:
+        # 推理放在独立进程中，图像经共享内存传递；推理进程崩溃或泄漏内存不影响Web进程
+        inference_queue = InferenceProcessPool(
+            yolo_detector.model_path,
+            backend=yolo_detector.backend,
+            num_workers=YOLO_INFERENCE_PROCESSES,
+            max_side=yolo_detector.predict_kwargs["imgsz"],
+            max_batch_size=YOLO_BATCH_SIZE,
+            max_tasks_per_worker=YOLO_WORKER_MAX_TASKS,
+            warmup_sizes=YOLO_WARMUP_SIZES
+        )
+    else:
+        # 所有请求线程共用一个批处理队列，模型只在队列的工作线程里调用
+        inference_queue = BatchInferenceQueue(
+            yolo_detector,
+            max_batch_size=YOLO_BATCH_SIZE,
+            max_wait_ms=YOLO_BATCH_TIMEOUT_MS
+        )
+    
+    # 推理排队已满或超过截止时间的请求快速失败，避免延迟无限增长
+    admission = AdmissionController(max_pending=YOLO_MAX_PENDING, deadline_ms=YOLO_DEADLINE_MS)
+    
+    # 模糊、过暗/过曝、没拍到排泄物的图像在推理前直接拒绝，提示重新拍摄
+    if YOLO_QUALITY_GATE:
+        quality_gate = ImageQualityGate(min_sharpness=YOLO_MIN_SHARPNESS)
+    
+    # 重复上传的同一张图片直接返回缓存结果
+    if YOLO_CACHE_SIZE > 0:
+        result_cache = ResultCache(
+            max_entries=YOLO_CACHE_SIZE,
+            ttl=YOLO_CACHE_TTL,
+            persist_path=YOLO_CACHE_PATH
+        )
+    
+    # 批量接口的并行解码线程，每个线程解码后把图像交给批处理队列
+    batch_executor = ThreadPoolExecutor(max_workers=YOLO_DECODE_WORKERS, thread_name_prefix="batch-decode")
+    
+    # 同一只猫短时间内连拍/重新编码的相似图片复用之前的结果
+    if YOLO_DEDUP_DISTANCE >= 0:
+        duplicate_index = NearDuplicateIndex(
+            max_distance=YOLO_DEDUP_DISTANCE,
+            window_seconds=YOLO_DEDUP_WINDOW,
+            max_color_distance=YOLO_DEDUP_COLOR_DISTANCE
+        )
+    
+    # 每个分析结果写入 health_records；后台线程批量提交，不占用请求的响应时间
+    try:
+        record_writer = HealthRecordWriter(
+            max_queue=HEALTH_RECORD_QUEUE_SIZE,
+            batch_size=HEALTH_RECORD_BATCH_SIZE,
+            flush_interval=HEALTH_RECORD_FLUSH_MS / 1000.0,
+            derived_stores=(trend_store, rollup_store)
+        )
+    except Exception as e:
+        print(f" 健康记录写入初始化失败: {e}")
+    
+    threading.Thread(target=warmup_model, name="yolo-warmup", daemon=True).start()
+
+if not PREFORK and not SPAWNED_CHILD:
+    start_inference_services()
+elif PREFORK and yolo_detector is not None and YOLO_INFERENCE_PROCESSES == 0 and yolo_detector.prepare_for_fork():
+    # 权重留在主进程内存中，fork出的worker以写时复制方式共享
+    print(" 预加载模式: 模型权重已在主进程加载，fork后由各worker共享")
+
+def warming_up_payload():
+    """加载/预热期间拒绝分析请求，提示稍后重试（配合503和 Retry-After 头）"""
+    return {"success": False, "error": "模型加载/预热中，请稍后重试", "warmup": warmup_info}
+
+def warming_up_response():
+    return jsonify(warming_up_payload()), 503, RETRY_AFTER_HEADERS
+
+def is_cacheable(result):
+    """检测异常时的备用结果和过载降级结果不缓存，下次重试仍会重新检测"""
+    return result.get("analysis_info", {}).get("type") != "备用分析" and not result.get("degraded")
 
 @app.route('/')
 def home():
@@ -71,74 +307,509 @@ def home():
         "environment": "render" if is_render else "local"
     })
 
+def health_status():
+    """负载均衡健康检查：预热完成前返回503，避免流量进入冷实例"""
+    ready = model_ready.is_set()
+    return {
+        "status": "healthy" if ready else "warming_up",
+        "ready": ready,
+        "yolo": "available" if yolo_available else "unavailable",
+        "model_loaded": yolo_available,
+        "warmup": warmup_info
+    }, 200 if ready else 503
+
+@app.route('/health')
 @app.route('/api/health')
 def health():
-    return jsonify({
-        "status": "healthy",
-        "yolo": "available" if yolo_available else "unavailable",
-        "model_loaded": yolo_detector is not None and yolo_detector.model is not None
-    })
+    body, status = health_status()
+    return jsonify(body), status
 
-@app.route('/api/ai/analyze', methods=['POST'])
-def analyze_stool():
-    """智能分析端点 - 自动处理YOLO可用性"""
+def simulated_result():
+    """YOLO不可用时返回的模拟结果（标明状态）"""
+    return {
+        "detection": {
+            "color": "模拟", "texture": "模拟", "shape": "模拟",
+            "confidence": 0.85, "class_name": "normal"
+        },
+        "health_analysis": {
+            "risk_level": "normal", "message": "模拟分析",
+            "description": "AI服务准备中，当前使用模拟数据",
+            "confidence": 0.85,
+            "recommendation": "YOLOv8服务配置中，请稍后重试真实检测",
+            "detected_class": "normal"
+        },
+        "simulation": True,
+        "yolo_available": False
+    }
+
+def analyze_image_bytes(image_bytes, cat_id=None):
+    """
+    真实YOLO分析流程: 结果缓存 -> 解码 -> 质量检查 -> 近似重复检测 -> 批处理推理
+    图像无法解码时返回 None，质量不合格时抛出 PoorImageQualityError
+    """
+    cache_key = make_cache_key(image_bytes, yolo_detector.model_version, yolo_detector.predict_kwargs)
+    result = result_cache.get(cache_key) if result_cache else None
+    
+    if result is None:
+        image = yolo_detector.bytes_to_image(image_bytes)
+        if image is None:
+            return None
+        
+        quality = quality_gate.check(image) if quality_gate else None
+        
+        # 近似重复只在同一只猫内查找；没有传 cat_id 时无法区分客户端，不复用其他人的结果
+        dedup_cat = parse_cat_id(cat_id)
+        image_hash = image.info.get("dhash") if duplicate_index and dedup_cat is not None else None
+        image_color = image.info.get("mean_hsv")
+        distance = None
+        if image_hash is not None:
+            result, distance = duplicate_index.find(dedup_cat, image_hash, image_color)
+        
+        if result is None:
+            result = infer_with_admission(image)
+            if is_cacheable(result) and image_hash is not None:
+                duplicate_index.add(dedup_cat, image_hash, result, image_color)
+        else:
+            print(f" 近似重复图像，复用结果 (哈希距离: {distance})")
+        
+        if result_cache and is_cacheable(result):
+            result_cache.put(cache_key, result)
+        result["cached"] = False
+        result["near_duplicate"] = distance is not None
+        result["quality"] = quality
+    else:
+        print(" 命中结果缓存")
+        result["cached"] = True
+    
+    result.setdefault("degraded", False)
+    result["yolo_available"] = True
+    result["simulation"] = False
+    save_health_record(cat_id, result)
+    return result
+
+def save_health_record(cat_id, result):
+    """
+    分析结果放入后台写入队列，写入 health_records
+    只保存新的推理结果：命中缓存或复用近似重复图像的结果是同一次检测的重试/重复上传，
+    再写一行会让趋势的连续次数、日/周汇总的计数重复累加；
+    没有传 cat_id（仪表盘匿名上传等）或不是整数时 cat_id 存为 NULL，记录照常保存，不查询 cats 表
+    """
+    if record_writer is None or result.get("cached") or result.get("near_duplicate"):
+        return
+    record_writer.enqueue(record_from_result(parse_cat_id(cat_id), result))
+
+def infer_with_admission(image):
+    """
+    准入控制下的推理：队列已满或超过截止时间时抛出 OverloadedError，
+    开启 YOLO_DEGRADE_ON_OVERLOAD 时改为返回颜色特征快速分析结果（degraded: true）
+    """
+    try:
+        with admission.admit() as deadline:
+            future = inference_queue.submit_async(image, timeout=admission.remaining(deadline))
+            return admission.wait(future, deadline)
+    except (OverloadedError, TimeoutError) as e:
+        # 推理进程池在截止时间内等不到空闲共享内存槽位时抛出 TimeoutError，同样按超时处理
+        if not isinstance(e, OverloadedError):
+            admission.record_timeout()
+        if not YOLO_DEGRADE_ON_OVERLOAD:
+            raise OverloadedError(str(e))
+        print(f" 推理过载，降级为图像特征分析: {e}")
+        admission.record_degraded()
+        return yolo_detector.degraded_result(image)
+
+class UploadTooLargeError(Exception):
+    """上传超过 MAX_UPLOAD_BYTES"""
+
+class LengthRequiredError(Exception):
+    """multipart上传没有声明 Content-Length"""
+
+def is_direct_upload(mimetype):
+    """原始图像请求体 (image/jpeg 等) 或 multipart 上传，而不是JSON里的base64"""
+    return mimetype.startswith('image/') or mimetype in ('application/octet-stream', 'multipart/form-data')
+
+def body_limit(mimetype):
+    """请求体大小上限：原始图像按图像上限，multipart加上表单开销，JSON按base64膨胀后的大小"""
+    if mimetype == 'multipart/form-data':
+        return MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD
+    if is_direct_upload(mimetype):
+        return MAX_UPLOAD_BYTES
+    return MAX_UPLOAD_BYTES * 4 // 3 + MULTIPART_OVERHEAD
+
+def check_content_length(content_length, mimetype, limit=None):
+    """
+    声明的 Content-Length 超过上限时不读取请求体，直接拒绝；limit 默认按单张图像计算
+    multipart 表单解析会先把整个文件写入临时文件，没有声明长度（分块传输）时无法预先限制，直接拒绝
+    """
+    if content_length is None and mimetype == 'multipart/form-data':
+        raise LengthRequiredError("multipart上传需要 Content-Length")
+    if content_length is not None and content_length > (limit or body_limit(mimetype)):
+        raise UploadTooLargeError(f"上传超过 {(limit or MAX_UPLOAD_BYTES) // (1024 * 1024)}MB 上限")
+
+def read_limited(stream, limit=MAX_UPLOAD_BYTES):
+    """按块读取，累计超过 limit 时立即停止读取并抛出 UploadTooLargeError"""
+    chunks = []
+    total = 0
+    while True:
+        chunk = stream.read(min(UPLOAD_CHUNK_SIZE, limit + 1 - total))
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > limit:
+            raise UploadTooLargeError(f"上传超过 {limit // (1024 * 1024)}MB 上限")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+def analyze_payload(data=None, image_bytes=None, cat_id=None):
+    """
+    智能分析 - 自动处理YOLO可用性
+    data 为JSON请求体 {"image": base64, "cat_id": 可选}；直接上传时传入原始图像字节 image_bytes
+    返回 (响应字典, 状态码, 响应头)，WSGI(本文件)和ASGI(asgi.py)两种服务方式共用
+    """
     try:
-        data = request.get_json()
+        if not image_bytes and (not data or 'image' not in data):
+            return {"success": False, "error": "没有图像数据"}, 400, {}
+        if cat_id is None and data:
+            cat_id = data.get('cat_id')
         
-        if not data or 'image' not in data:
-            return jsonify({"success": False, "error": "没有图像数据"}), 400
+        if not model_ready.is_set():
+            return warming_up_payload(), 503, RETRY_AFTER_HEADERS
         
         print(f" 收到分析请求 - YOLO状态: {'可用' if yolo_available else '不可用'}")
         
         if not yolo_available or yolo_detector is None:
             # YOLO不可用，返回模拟结果但标明状态
-            return jsonify({
-                "success": True,
-                "detection": {
-                    "color": "模拟", "texture": "模拟", "shape": "模拟",
-                    "confidence": 0.85, "class_name": "normal"
-                },
-                "health_analysis": {
-                    "risk_level": "normal", "message": "模拟分析",
-                    "description": "AI服务准备中，当前使用模拟数据",
-                    "confidence": 0.85,
-                    "recommendation": "YOLOv8服务配置中，请稍后重试真实检测",
-                    "detected_class": "normal"
-                },
-                "simulation": True,
-                "yolo_available": False
-            })
+            return {"success": True, **simulated_result()}, 200, {}
         
         # 使用真实YOLO检测
-        image = yolo_detector.base64_to_image(data['image'])
-        if image is None:
-            return jsonify({"success": False, "error": "图像解码失败"}), 400
+        if image_bytes is None:
+            try:
+                image_bytes = decode_base64(data['image'])
+            except Exception as e:
+                print(f" base64解码失败: {e}")
+                return {"success": False, "error": "图像解码失败"}, 400, {}
         
-        result = yolo_detector.detect_stool_features(image)
-        result["yolo_available"] = True
-        result["simulation"] = False
+        result = analyze_image_bytes(image_bytes, cat_id=cat_id)
+        if result is None:
+            return {"success": False, "error": "图像解码失败"}, 400, {}
         
-        return jsonify({"success": True, **result})
+        return {"success": True, **result}, 200, {}
         
+    except PoorImageQualityError as e:
+        print(f" 图像质量不合格: {e.code} {e.metrics}")
+        return {"success": False, "error": str(e), "retake_photo": True, "quality": e.to_dict()}, 422, {}
+    except OverloadedError as e:
+        print(f" 推理过载，拒绝请求: {e}")
+        return {"success": False, "error": f"服务繁忙，请稍后重试 ({e})", "overloaded": True}, 503, RETRY_AFTER_HEADERS
     except Exception as e:
         print(f" 分析失败: {e}")
-        return jsonify({
+        return {
             "success": False, 
             "error": str(e),
             "yolo_available": yolo_available
-        }), 500
+        }, 500, {}
 
-@app.route('/api/debug/yolo-status')
-def debug_yolo():
-    """调试YOLO状态"""
+@app.route('/api/ai/analyze', methods=['POST'])
+@app.route('/analyze/stool', methods=['POST'])
+def analyze_stool():
+    """
+    智能分析端点 - 自动处理YOLO可用性
+    支持三种请求体: JSON {"image": base64}、原始图像 (Content-Type: image/jpeg 等，?cat_id=)、
+    multipart/form-data 的 image 文件字段（cat_id 表单字段）
+    """
+    try:
+        check_content_length(request.content_length, request.mimetype)
+        if is_direct_upload(request.mimetype):
+            image_bytes, cat_id = read_image_upload()
+            body, status, headers = analyze_payload(image_bytes=image_bytes, cat_id=cat_id)
+        else:
+            body, status, headers = analyze_payload(request.get_json(silent=True))
+    except UploadTooLargeError as e:
+        body, status, headers = {"success": False, "error": str(e)}, 413, {}
+    except LengthRequiredError as e:
+        body, status, headers = {"success": False, "error": str(e)}, 411, {}
+    return jsonify(body), status, headers
+
+def read_image_upload():
+    """
+    读取直接上传的图像，返回 (图像字节, cat_id)
+    原始请求体按块读取、超过上限立即停止；multipart由werkzeug按块写入临时文件，再从中读出
+    """
+    cat_id = request.args.get('cat_id')
+    if request.mimetype == 'multipart/form-data':
+        file = request.files.get('image')
+        cat_id = request.form.get('cat_id', cat_id)
+        image_bytes = read_limited(file.stream) if file else b""
+    else:
+        image_bytes = read_limited(request.stream)
+    return image_bytes, cat_id
+
+def read_batch_items(decode=True):
+    """
+    读取批量请求中的图像，返回 [(序号, 名称, 图像字节或None, 错误信息)]
+    支持 multipart/form-data（多个文件）和 NDJSON（每行 {"image": base64, "id": 可选}）
+    decode=False 时只解析请求结构，不解码base64（模拟模式）
+    请求体超过 MAX_BATCH_BYTES 时抛出 UploadTooLargeError；单张图像超过 MAX_UPLOAD_BYTES 时该项报错
+    """
+    check_content_length(request.content_length, request.mimetype, limit=MAX_BATCH_BYTES)
+    items = []
+    if request.files:
+        total = 0
+        for index, file in enumerate(request.files.getlist('images') or request.files.getlist('image')):
+            try:
+                image_bytes = read_limited(file.stream)
+            except UploadTooLargeError as e:
+                items.append((index, file.filename, None, str(e)))
+                continue
+            total += len(image_bytes)
+            if total > MAX_BATCH_BYTES:
+                raise UploadTooLargeError(f"批量上传超过 {MAX_BATCH_BYTES // (1024 * 1024)}MB 上限")
+            items.append((index, file.filename, image_bytes, None))
+        return items
+    
+    for index, line in enumerate(read_limited(request.stream, MAX_BATCH_BYTES).splitlines()):
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+            image_bytes = decode_base64(entry['image']) if decode else None
+            if image_bytes is not None and len(image_bytes) > MAX_UPLOAD_BYTES:
+                raise UploadTooLargeError(f"图像超过 {MAX_UPLOAD_BYTES // (1024 * 1024)}MB 上限")
+            items.append((len(items), entry.get('id', str(len(items))), image_bytes, None))
+        except Exception as e:
+            items.append((len(items), str(len(items)), None, f"第{index + 1}行解析失败: {e}"))
+    return items
+
+@app.route('/api/ai/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """批量分析：并行解码、批量推理，每张图像完成后立即以NDJSON返回一行结果"""
+    if not model_ready.is_set():
+        return warming_up_response()
+    
+    try:
+        items = read_batch_items(decode=yolo_available)
+    except UploadTooLargeError as e:
+        return jsonify({"success": False, "error": str(e)}), 413
+    except LengthRequiredError as e:
+        return jsonify({"success": False, "error": str(e)}), 411
+    if not items:
+        return jsonify({"success": False, "error": "没有图像数据"}), 400
+    if len(items) > YOLO_BATCH_MAX_IMAGES:
+        return jsonify({"success": False, "error": f"单次最多 {YOLO_BATCH_MAX_IMAGES} 张图像"}), 413
+    
+    if not yolo_available or yolo_detector is None:
+        lines = [
+            json.dumps({"index": index, "id": name, "success": False, "error": error} if error else
+                       {"index": index, "id": name, "success": True, **simulated_result()}, ensure_ascii=False)
+            for index, name, _, error in items
+        ]
+        return Response("\n".join(lines) + "\n", mimetype='application/x-ndjson')
+    
+    cat_id = request.args.get('cat_id')
+    print(f" 收到批量分析请求: {len(items)} 张图像")
+    
+    def analyze_item(index, name, image_bytes, error):
+        if error is None:
+            try:
+                result = analyze_image_bytes(image_bytes, cat_id=cat_id)
+                if result is not None:
+                    return {"index": index, "id": name, "success": True, **result}
+                error = "图像解码失败"
+            except PoorImageQualityError as e:
+                return {"index": index, "id": name, "success": False, "error": str(e),
+                        "retake_photo": True, "quality": e.to_dict()}
+            except Exception as e:
+                error = str(e)
+        return {"index": index, "id": name, "success": False, "error": error}
+    
+    futures = [batch_executor.submit(analyze_item, *item) for item in items]
+    
+    def generate():
+        for future in as_completed(futures):
+            yield json.dumps(future.result(), ensure_ascii=False) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/ai/jobs', methods=['POST'])
+def create_analysis_job():
+    """提交异步分析任务，立即返回任务ID"""
+    if job_runner is None:
+        return jsonify({"success": False, "error": "异步任务服务不可用"}), 503
+    
+    try:
+        # 与单张分析相同的大小限制；任务排队期间图像字节保存在内存中
+        check_content_length(request.content_length, request.mimetype)
+        data = request.get_json(silent=True)
+        if not data or 'image' not in data:
+            return jsonify({"success": False, "error": "没有图像数据"}), 400
+        image_bytes = decode_base64(data['image']) if yolo_detector is not None else b""
+        if len(image_bytes) > MAX_UPLOAD_BYTES:
+            raise UploadTooLargeError(f"上传超过 {MAX_UPLOAD_BYTES // (1024 * 1024)}MB 上限")
+    except UploadTooLargeError as e:
+        return jsonify({"success": False, "error": str(e)}), 413
+    except LengthRequiredError as e:
+        return jsonify({"success": False, "error": str(e)}), 411
+    except Exception as e:
+        print(f" base64解码失败: {e}")
+        return jsonify({"success": False, "error": "图像解码失败"}), 400
+    
+    cat_id = data.get('cat_id')
+    try:
+        job_id = job_runner.submit({"image_bytes": image_bytes, "cat_id": cat_id}, cat_id=cat_id)
+    except QueueFullError as e:
+        return jsonify({"success": False, "error": str(e)}), 503, RETRY_AFTER_HEADERS
+    
     return jsonify({
+        "success": True,
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/api/ai/jobs/{job_id}",
+        "events_url": f"/api/ai/jobs/{job_id}/events"
+    }), 202
+
+@app.route('/api/ai/jobs/<job_id>')
+def get_analysis_job(job_id):
+    """查询任务状态；?wait=秒数 时长轮询直到任务完成或超时"""
+    if job_runner is None:
+        return jsonify({"success": False, "error": "异步任务服务不可用"}), 503
+    
+    wait = min(max(request.args.get('wait', 0, type=float), 0), JOB_MAX_WAIT)
+    job = job_runner.wait(job_id, wait)
+    if job is None:
+        return jsonify({"success": False, "error": "任务不存在"}), 404
+    return jsonify({"success": True, **job})
+
+@app.route('/api/ai/jobs/<job_id>/events')
+def stream_analysis_job(job_id):
+    """SSE推送任务状态变化，任务完成后发送 result 事件并结束"""
+    if job_runner is None:
+        return jsonify({"success": False, "error": "异步任务服务不可用"}), 503
+    
+    job = job_runner.store.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "任务不存在"}), 404
+    
+    def generate(job):
+        last_status = None
+        idle = 0
+        while True:
+            if job["status"] != last_status:
+                last_status = job["status"]
+                event = "result" if last_status in ("succeeded", "failed") else "status"
+                yield f"event: {event}\ndata: {json.dumps(job, ensure_ascii=False)}\n\n"
+                if event == "result":
+                    return
+                idle = 0
+            elif idle >= 15:
+                # 保持连接，防止代理超时断开
+                yield ": keepalive\n\n"
+                idle = 0
+            job = job_runner.wait(job_id, 1.0)
+            if job is None:
+                return
+            idle += 1
+    
+    return Response(
+        stream_with_context(generate(job)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/cats/<cat_id>/history')
+def cat_health_history(cat_id):
+    """
+    猫咪的健康记录历史，从新到旧分页
+    ?limit=每页条数（最多100）&cursor=上一页返回的 next_cursor&include_result=1 时返回完整分析结果
+    """
+    if health_history is None:
+        return jsonify({"success": False, "error": "历史记录服务不可用"}), 503
+    
+    try:
+        page = health_history.page(
+            cat_id,
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', 20, type=int),
+            include_result=request.args.get('include_result') in ('1', 'true')
+        )
+    except InvalidCursorError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify({"success": True, "cat_id": cat_id, **page})
+
+@app.route('/api/cats/<cat_id>/trend')
+def cat_health_trend(cat_id):
+    """猫咪的健康趋势（EWMA风险分数、连续次数、距上次正常的时间、升级提醒），只读一行预先计算的状态"""
+    if trend_store is None:
+        return jsonify({"success": False, "error": "趋势服务不可用"}), 503
+    
+    trend = trend_store.get(cat_id)
+    if trend is None:
+        return jsonify({"success": False, "error": "没有这只猫的健康记录"}), 404
+    return jsonify({"success": True, "cat_id": cat_id, "trend": trend})
+
+@app.route('/api/cats/<cat_id>/summary')
+def cat_health_summary(cat_id):
+    """
+    仪表盘图表数据，直接读取日/周汇总表
+    ?period=day|week&from=YYYY-MM-DD&to=YYYY-MM-DD（默认最近30天/26周，日期按UTC）
+    """
+    if rollup_store is None:
+        return jsonify({"success": False, "error": "汇总服务不可用"}), 503
+    
+    period = request.args.get('period', 'day')
+    if period not in ('day', 'week'):
+        return jsonify({"success": False, "error": "period 只能是 day 或 week"}), 400
+    try:
+        chart = rollup_store.chart(cat_id, period, start=request.args.get('from'), end=request.args.get('to'))
+    except ValueError:
+        return jsonify({"success": False, "error": "日期格式应为 YYYY-MM-DD"}), 400
+    return jsonify({"success": True, "cat_id": cat_id, **chart})
+
+def yolo_status():
+    """调试用的YOLO状态"""
+    return {
         "yolo_available": yolo_available,
         "model_loaded": yolo_detector is not None and yolo_detector.model is not None,
         "environment": "render" if is_render else "local",
         "current_dir": current_dir,
         "model_path": yolo_detector.model_path if yolo_detector else None,
-        "model_exists": os.path.exists(yolo_detector.model_path) if yolo_detector else False
-    })
+        "backend": yolo_detector.backend if yolo_detector else None,
+        "adaptive_resolution": {
+            "imgsz": yolo_detector.adaptive_imgsz, "conf": yolo_detector.adaptive_conf
+        } if yolo_detector and yolo_detector.adaptive_enabled else None,
+        "model_exists": os.path.exists(yolo_detector.model_path) if yolo_detector else False,
+        "batching": inference_queue.stats() if inference_queue else None,
+        "result_cache": result_cache.stats() if result_cache else None,
+        "near_duplicates": duplicate_index.stats() if duplicate_index else None,
+        "jobs": job_runner.stats() if job_runner else None,
+        "admission": admission.stats() if admission else None,
+        "quality_gate": quality_gate.stats() if quality_gate else None,
+        "health_records": record_writer.stats() if record_writer else None,
+        "warmup": warmup_info,
+        "process": {"pid": os.getpid(), "prefork": PREFORK, "memory": read_smaps_rollup()}
+    }
+
+@app.route('/api/debug/yolo-status')
+def debug_yolo():
+    """调试YOLO状态"""
+    return jsonify(yolo_status())
+
+def metrics_text():
+    """Prometheus文本格式的推理指标：队列深度、准入/拒绝/超时/降级计数"""
+    if admission is None:
+        return ""
+    return admission.metrics_text(queue_depth=inference_queue.pending() if inference_queue else 0)
+
+@app.route('/metrics')
+def metrics():
+    return Response(metrics_text(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/debug/inference-workers/restart', methods=['POST'])
+def restart_inference_workers():
+    """平滑重启推理进程（处理完手上的任务后由新进程替换）"""
+    # 检测器创建失败时没有导入 InferenceProcessPool，按接口判断
+    restart_workers = getattr(inference_queue, "restart_workers", None)
+    if restart_workers is None:
+        return jsonify({"success": False, "error": "未启用独立推理进程 (YOLO_INFERENCE_PROCESSES)"}), 400
+    return jsonify({"success": True, "restarting": restart_workers()})
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 10000))
@@ -0,0 +1,153 @@
+﻿"""
+异步(ASGI)服务模式，接口和JSON格式与 app.py 完全相同
+
+    uvicorn asgi:application --host 0.0.0.0 --port 10000
+
+- 请求体在事件循环中异步读取，慢速上传和空闲的长连接不占用线程
+- 与 app.py 一样接受JSON(base64)、原始图像请求体和multipart上传，读取时按上限截断
+- JSON解析、base64解码和推理交给有界线程池 (ASGI_EXECUTOR_THREADS)，事件循环不被阻塞
+- 模型加载、批处理队列、结果缓存等仍由 app.py 初始化，两种模式共用同一套分析逻辑
+"""
+import asyncio
+import functools
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+import app as service
+
+ASGI_EXECUTOR_THREADS = int(os.environ.get('ASGI_EXECUTOR_THREADS', max(service.YOLO_BATCH_SIZE, 1) * 2))
+
+executor = ThreadPoolExecutor(max_workers=ASGI_EXECUTOR_THREADS, thread_name_prefix="asgi-analyze")
+
+
+async def home(request):
+    return JSONResponse({
+        "service": "CatHealth Full Stack",
+        "status": "running",
+        "yolo_available": service.yolo_available,
+        "environment": "render" if service.is_render else "local",
+        "server": "asgi"
+    })
+
+
+async def health(request):
+    body, status = service.health_status()
+    return JSONResponse(body, status_code=status)
+
+
+class BadRequestError(Exception):
+    """请求头不合法（如 Content-Length 不是非负整数）"""
+
+
+def parse_content_length(value):
+    if value is None:
+        return None
+    try:
+        length = int(value)
+    except ValueError:
+        length = -1
+    if length < 0:
+        raise BadRequestError("Content-Length 不合法")
+    return length
+
+
+async def read_limited(request, limit):
+    """异步按块读取请求体，累计超过 limit 时立即停止"""
+    chunks = []
+    total = 0
+    async for chunk in request.stream():
+        total += len(chunk)
+        if total > limit:
+            raise service.UploadTooLargeError(f"上传超过 {limit // (1024 * 1024)}MB 上限")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def read_analyze_request(request):
+    """解析分析请求，返回传给 service.analyze_payload 的参数"""
+    mimetype = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    content_length = parse_content_length(request.headers.get('content-length'))
+    # multipart 没有声明长度时抛出 LengthRequiredError（表单解析会读完整个请求体）
+    service.check_content_length(content_length, mimetype)
+
+    if mimetype == 'multipart/form-data':
+        form = await request.form()
+        upload = form.get('image')
+        image_bytes = await upload.read() if upload is not None and hasattr(upload, 'read') else b""
+        if len(image_bytes) > service.MAX_UPLOAD_BYTES:
+            raise service.UploadTooLargeError(f"上传超过 {service.MAX_UPLOAD_BYTES // (1024 * 1024)}MB 上限")
+        cat_id = form.get('cat_id') or request.query_params.get('cat_id')
+        return {"image_bytes": image_bytes, "cat_id": cat_id}
+
+    body = await read_limited(request, service.body_limit(mimetype))
+    if service.is_direct_upload(mimetype):
+        return {"image_bytes": body, "cat_id": request.query_params.get('cat_id')}
+
+    # JSON 在线程池中解析 (analyze_json_body)，十几MB的base64不阻塞事件循环
+    return {"body": body}
+
+
+def analyze_json_body(body):
+    """解析JSON请求体后执行分析，在线程池中运行"""
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        data = None
+    return service.analyze_payload(data)
+
+
+async def analyze(request):
+    try:
+        kwargs = await read_analyze_request(request)
+    except service.UploadTooLargeError as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=413)
+    except service.LengthRequiredError as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=411)
+    except BadRequestError as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400)
+
+    if "body" in kwargs:
+        task = functools.partial(analyze_json_body, kwargs["body"])
+    else:
+        task = functools.partial(service.analyze_payload, **kwargs)
+    loop = asyncio.get_running_loop()
+    payload, status, headers = await loop.run_in_executor(executor, task)
+    return JSONResponse(payload, status_code=status, headers=headers)
+
+
+async def yolo_status(request):
+    return JSONResponse(service.yolo_status())
+
+
+async def metrics(request):
+    return PlainTextResponse(service.metrics_text(), media_type='text/plain; version=0.0.4')
+
+
+application = Starlette(
+    routes=[
+        Route('/', home),
+        Route('/health', health),
+        Route('/api/health', health),
+        Route('/api/ai/analyze', analyze, methods=['POST']),
+        Route('/analyze/stool', analyze, methods=['POST']),
+        Route('/api/debug/yolo-status', yolo_status),
+        Route('/metrics', metrics)
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    on_shutdown=[lambda: executor.shutdown(wait=False)]
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.environ.get('PORT', 10000))
+    print(f" ASGI服务启动在端口 {port}")
+    uvicorn.run(application, host='0.0.0.0', port=port)
@@ -0,0 +1,159 @@
+﻿"""
+启动耗时基准：各模块导入耗时 + 服务从启动到第一次响应 /health 的时间
+
+用法:
+    cd backend/python
+    python benchmark_startup.py                                  # 测量根目录 app.py
+    python benchmark_startup.py --target fixed_yolo_backend.py --health-path /health
+    python benchmark_startup.py --runs 3 --output startup.json
+
+每个模块在全新的解释器里用 -X importtime 单独测量（不受其他模块已导入的影响），
+服务启动时间分两项: 第一次收到 /health 响应（进程可以接流量）和 /health 返回200（模型已就绪）。
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+PYTHON_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.abspath(os.path.join(PYTHON_DIR, "..", ".."))
+
+DEFAULT_MODULES = ["flask", "numpy", "PIL.Image", "cv2", "onnxruntime", "torch", "ultralytics", "yolo", "storage"]
+
+
+def measure_import(module):
+    """在新进程中导入模块，返回累计导入耗时(ms)；模块不存在时返回 None"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PYTHON_DIR, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        return None
+
+    # 每行格式: "import time:  self [us] | cumulative | imported package"
+    # 顶层模块的那一行累计时间包含了它导入的所有子模块
+    top_level = module.split(".")[0]
+    cumulative = 0
+    for line in proc.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == top_level:
+            cumulative = max(cumulative, int(parts[1].strip()))
+        elif len(parts) == 3 and parts[2].strip() == module:
+            cumulative = max(cumulative, int(parts[1].strip()))
+    return round(cumulative / 1000, 1)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def probe(url):
+    """返回HTTP状态码，连接失败返回 None"""
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except (urllib.error.URLError, OSError):
+        return None
+
+
+def measure_startup(target, health_path, timeout):
+    """启动服务进程并轮询健康检查，返回 (首次响应秒数, 就绪秒数)"""
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), PYTHONUNBUFFERED="1")
+    url = f"http://127.0.0.1:{port}{health_path}"
+
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, target],
+        cwd=os.path.dirname(target), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        # Flask调试模式会再启动一个重载子进程，放到同一进程组里一起结束
+        start_new_session=hasattr(os, "killpg")
+    )
+
+    first_response = None
+    ready = None
+    try:
+        while time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"服务进程已退出 (返回码 {proc.returncode})")
+            status = probe(url)
+            elapsed = time.perf_counter() - start
+            if status is not None and first_response is None:
+                first_response = round(elapsed, 3)
+            if status == 200:
+                ready = round(elapsed, 3)
+                break
+            time.sleep(0.05)
+    finally:
+        if hasattr(os, "killpg"):
+            os.killpg(proc.pid, signal.SIGTERM)
+        else:
+            proc.terminate()
+        proc.wait()
+    return first_response, ready
+
+
+def summarize(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    return {"median": round(statistics.median(values), 3), "min": min(values), "max": max(values)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="测量模块导入耗时和服务启动到 /health 可用的时间")
+    parser.add_argument("--target", default=os.path.join(ROOT_DIR, "app.py"), help="要启动的服务脚本")
+    parser.add_argument("--health-path", default="/api/health", help="健康检查路径")
+    parser.add_argument("--modules", default=",".join(DEFAULT_MODULES), help="要测量导入耗时的模块（逗号分隔）")
+    parser.add_argument("--runs", type=int, default=3, help="每项测量的重复次数（取中位数）")
+    parser.add_argument("--timeout", type=float, default=120, help="等待服务就绪的最长秒数")
+    parser.add_argument("--output", help="把结果写入JSON文件")
+    args = parser.parse_args(argv)
+
+    report = {"python": sys.version.split()[0], "imports_ms": {}, "startup_seconds": {}}
+
+    print("=" * 60)
+    print(" 模块导入耗时 (新进程, 累计ms)")
+    for module in [m.strip() for m in args.modules.split(",") if m.strip()]:
+        timings = [measure_import(module) for _ in range(args.runs)]
+        summary = summarize(timings)
+        report["imports_ms"][module] = summary
+        print(f" {module:<14} {'未安装' if summary is None else str(summary['median']) + ' ms'}")
+
+    target = os.path.abspath(args.target)
+    print(f" 服务启动: {target} ({args.health_path})")
+    first_responses, readies = [], []
+    for run in range(args.runs):
+        first_response, ready = measure_startup(target, args.health_path, args.timeout)
+        first_responses.append(first_response)
+        readies.append(ready)
+        print(f" 第{run + 1}次: 首次响应 {first_response}s, 就绪 {ready}s")
+
+    report["startup_seconds"] = {
+        "target": os.path.relpath(target, ROOT_DIR),
+        "first_health_response": summarize(first_responses),
+        "health_ready": summarize(readies)
+    }
+    print("=" * 60)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f" 结果已写入: {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+﻿"""
+cathealth-analyze: 离线批量分析图像目录
+
+用法:
+    cd backend/python
+    python cathealth_analyze.py ./photos --output results.jsonl
+    python cathealth_analyze.py --manifest photos.txt --output results.csv --workers 4
+    python cathealth_analyze.py ./photos --output results.jsonl --backend onnx   # 中断后再次运行会跳过已处理的图像
+
+每个工作进程只加载一次模型，按 --batch-size 张一批做前向推理，
+结果逐批追加写入 JSONL/CSV；输出文件中已成功分析的图像哈希会被跳过，因此可以断点续跑，
+读取/解码失败的图像在下次运行时重试。
+"""
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import defaultdict
+
+PYTHON_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(PYTHON_DIR)
+
+DEFAULT_MODEL = os.path.join(PYTHON_DIR, "models", "best.pt")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+CSV_FIELDS = ["path", "sha256", "class_id", "class_name", "confidence", "risk_level", "detection_method", "error"]
+
+# 每个工作进程各自持有的检测器
+_detector = None
+
+
+def iter_images(directory):
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, name)
+
+
+def read_manifest(manifest_path):
+    """清单文件每行一个图像路径，相对路径以清单所在目录为基准"""
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, encoding="utf-8-sig") as f:
+        for line in f:
+            path = line.strip()
+            if path and not path.startswith("#"):
+                yield path if os.path.isabs(path) else os.path.join(base_dir, path)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_processed_hashes(output_path):
+    """读取已有输出文件中成功分析的图像哈希，用于断点续跑；带 error 的记录不算完成"""
+    if not os.path.exists(output_path):
+        return set()
+
+    hashes = set()
+    with open(output_path, encoding="utf-8", newline="") as f:
+        if output_path.lower().endswith(".csv"):
+            for row in csv.DictReader(f):
+                if row.get("sha256") and not row.get("error"):
+                    hashes.add(row["sha256"])
+        else:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    if not record.get("error"):
+                        hashes.add(record["sha256"])
+                except (ValueError, KeyError, AttributeError):
+                    # 中断时可能留下写了一半的最后一行
+                    continue
+    return hashes
+
+
+def set_num_threads(num_threads):
+    """限制推理线程数；YOLO_NUM_THREADS 供 onnxruntime 后端使用"""
+    if num_threads:
+        for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "YOLO_NUM_THREADS"):
+            os.environ[name] = str(num_threads)
+
+
+def check_model(model_path, backend, num_threads):
+    """创建进程池之前在主进程中确认模型能加载"""
+    set_num_threads(num_threads)
+    from yolo import YOLODetector
+
+    return YOLODetector(model_path, backend=backend).model is not None
+
+
+def init_worker(model_path, backend, num_threads):
+    """
+    工作进程初始化：限制推理线程数后加载一次模型
+    加载失败时不抛出异常（进程池会不断重建抛出异常的进程），由 analyze_chunk 报错
+    """
+    global _detector
+    set_num_threads(num_threads)
+
+    try:
+        from yolo import YOLODetector
+
+        _detector = YOLODetector(model_path, backend=backend)
+    except Exception as e:
+        print(f" 工作进程加载模型失败: {e}")
+        _detector = None
+
+
+def analyze_chunk(tasks):
+    """在工作进程中分析一批图像，返回 (记录列表, 各阶段耗时)"""
+    if _detector is None or _detector.model is None:
+        raise RuntimeError("工作进程中模型加载失败")
+    timings = defaultdict(float)
+    records = []
+    images = []
+
+    for path, sha256 in tasks:
+        start = time.perf_counter()
+        try:
+            with open(path, "rb") as f:
+                image_bytes = f.read()
+        except OSError as e:
+            records.append({"path": path, "sha256": sha256, "error": f"读取失败: {e}"})
+            continue
+        timings["read"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        image = _detector.bytes_to_image(image_bytes)
+        timings["decode"] += time.perf_counter() - start
+
+        if image is None:
+            records.append({"path": path, "sha256": sha256, "error": "图像解码失败"})
+        else:
+            images.append((path, sha256, image))
+
+    if images:
+        start = time.perf_counter()
+        results = _detector.detect_stool_features_batch([image for _, _, image in images])
+        timings["inference"] += time.perf_counter() - start
+
+        for (path, sha256, _), result in zip(images, results):
+            records.append({"path": path, "sha256": sha256, "result": result})
+
+    return records, dict(timings)
+
+
+def open_writer(output_path):
+    """打开输出文件（追加模式），返回 write(record) 函数和文件对象"""
+    is_csv = output_path.lower().endswith(".csv")
+    is_new = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+    f = open(output_path, "a", encoding="utf-8", newline="")
+
+    if not is_csv:
+        def write(record):
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return write, f
+
+    writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+    if is_new:
+        writer.writeheader()
+
+    def write(record):
+        result = record.get("result") or {}
+        detection = result.get("detection", {})
+        writer.writerow({
+            "path": record["path"],
+            "sha256": record["sha256"],
+            "class_id": detection.get("class_id"),
+            "class_name": detection.get("class_name"),
+            "confidence": detection.get("confidence"),
+            "risk_level": result.get("health_analysis", {}).get("risk_level"),
+            "detection_method": result.get("analysis_info", {}).get("detection_method"),
+            "error": record.get("error")
+        })
+    return write, f
+
+
+def print_summary(processed, skipped, errors, elapsed, timings):
+    print("=" * 60)
+    print(f" 处理: {processed} 张, 跳过(已处理/重复): {skipped} 张, 失败: {errors} 张")
+    print(f" 总耗时: {elapsed:.1f}s, 吞吐: {processed / elapsed if elapsed > 0 else 0:.2f} 张/秒")
+    if processed:
+        for stage in ("hash", "read", "decode", "inference"):
+            print(f" {stage:<10} 平均 {timings.get(stage, 0.0) / processed * 1000:.1f} ms/张 (累计 {timings.get(stage, 0.0):.1f}s)")
+    print("=" * 60)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="cathealth-analyze", description="离线批量分析图像并输出JSONL/CSV")
+    parser.add_argument("directory", nargs="?", help="图像目录（递归查找）")
+    parser.add_argument("--manifest", help="图像清单文件，每行一个路径")
+    parser.add_argument("--output", required=True, help="结果文件，.jsonl 或 .csv")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="模型权重路径")
+    parser.add_argument("--backend", default=None, help="推理后端: torch / onnx / onnx-int8")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="工作进程数")
+    parser.add_argument("--threads", type=int, default=1, help="每个工作进程的推理线程数")
+    parser.add_argument("--batch-size", type=int, default=8, help="每次前向推理的图像数")
+    args = parser.parse_args(argv)
+
+    if not args.directory and not args.manifest:
+        parser.error("需要提供图像目录或 --manifest")
+
+    paths = read_manifest(args.manifest) if args.manifest else iter_images(args.directory)
+    done = load_processed_hashes(args.output)
+    if done:
+        print(f" 续跑: 输出文件中已有 {len(done)} 张图像的结果")
+
+    timings = defaultdict(float)
+    tasks = []
+    skipped = 0
+    start = time.perf_counter()
+    for path in paths:
+        hash_start = time.perf_counter()
+        try:
+            sha256 = file_sha256(path)
+        except OSError as e:
+            print(f" 无法读取 {path}: {e}")
+            continue
+        timings["hash"] += time.perf_counter() - hash_start
+
+        if sha256 in done:
+            skipped += 1
+            continue
+        done.add(sha256)
+        tasks.append((path, sha256))
+
+    print(f" 待处理: {len(tasks)} 张, 跳过: {skipped} 张, 进程数: {args.workers}")
+    if tasks and not check_model(args.model, args.backend, args.threads):
+        print(f" 模型加载失败: {args.model}")
+        sys.exit(1)
+    chunks = [tasks[i:i + args.batch_size] for i in range(0, len(tasks), args.batch_size)]
+
+    processed = 0
+    errors = 0
+    write, output_file = open_writer(args.output)
+    context = multiprocessing.get_context("spawn")
+    try:
+        with context.Pool(
+            processes=args.workers,
+            initializer=init_worker,
+            initargs=(args.model, args.backend, args.threads)
+        ) as pool:
+            for records, chunk_timings in pool.imap_unordered(analyze_chunk, chunks):
+                for record in records:
+                    write(record)
+                    processed += 1
+                    errors += 1 if record.get("error") else 0
+                output_file.flush()
+                for stage, seconds in chunk_timings.items():
+                    timings[stage] += seconds
+                print(f" 进度: {processed}/{len(tasks)}")
+    except KeyboardInterrupt:
+        print(" 已中断，重新运行相同命令即可继续")
+    except RuntimeError as e:
+        print(f" 分析失败: {e}")
+        sys.exit(1)
+    finally:
+        output_file.close()
+
+    print_summary(processed, skipped, errors, time.perf_counter() - start, timings)
+
+
+if __name__ == "__main__":
+    main()
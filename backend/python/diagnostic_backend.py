@@ -5,7 +5,7 @@ import io
 from PIL import Image
 import numpy as np
 import os
-import cv2
+from yolo.lazy_model import LazyModel
 
 app = Flask(__name__)
 CORS(app)
@@ -21,27 +21,8 @@ model_path = r"C:\Users\user\cathealth-app\backend\python\models\best.pt"
 print(f"📁 模型路径: {model_path}")
 print(f"🔍 模型文件存在: {os.path.exists(model_path)}")
 
-# 尝试导入YOLO
-try:
-    from ultralytics import YOLO
-    print(" 成功导入YOLO")
-    
-    if os.path.exists(model_path):
-        print(" 加载YOLO模型...")
-        model = YOLO(model_path)
-        print(" YOLO模型加载成功")
-        print(f" 模型类别: {model.names}")
-        print(f" 模型信息: 类别数={len(model.names)}")
-    else:
-        print(" 模型文件不存在")
-        model = None
-        
-except ImportError as e:
-    print(f" 无法导入ultralytics: {e}")
-    model = None
-except Exception as e:
-    print(f" 模型加载失败: {e}")
-    model = None
+# YOLO模型在第一次分析请求时才导入ultralytics并加载，启动和健康检查不等待模型
+model = LazyModel(model_path)
 
 # 类别映射
 CLASS_MAPPING = {
@@ -54,6 +35,8 @@ CLASS_MAPPING = {
 
 def improve_detection(image):
     """图像预处理提高检测率"""
+    import cv2
+
     # 转换为numpy数组
     img_np = np.array(image)
     
@@ -69,6 +52,59 @@ def improve_detection(image):
     
     return Image.fromarray(img_enhanced)
 
+# 检测方法: (方法名, 使用的图像, 置信度阈值)
+DETECTION_METHODS = [
+    ("原始图像", "original", 0.25),
+    ("预处理图像", "enhanced", 0.25),
+    ("低阈值", "original", 0.15)
+]
+# 以上方法都没有结果时的备用方法（原来的 imgsz=640 与默认推理尺寸相同）
+FALLBACK_METHOD = ("调整尺寸", "original", 0.1)
+# 批量推理使用所有方法中最低的阈值，其它阈值在原始预测上过滤
+RAW_CONF_THRESHOLD = min(threshold for _, _, threshold in DETECTION_METHODS + [FALLBACK_METHOD])
+
+def run_multiview_detection(original_image):
+    """构建所有图像变体并做一次批量前向推理，返回每个变体的原始预测"""
+    views = {
+        "original": original_image,
+        "enhanced": improve_detection(original_image)
+    }
+    names = list(views.keys())
+    results = model([views[name] for name in names], conf=RAW_CONF_THRESHOLD, imgsz=640)
+    
+    raw_predictions = {}
+    for name, result in zip(names, results):
+        boxes = result.boxes
+        if boxes is not None and len(boxes) > 0:
+            raw_predictions[name] = (boxes.conf.cpu().numpy(), boxes.cls.cpu().numpy())
+        else:
+            raw_predictions[name] = (np.zeros(0), np.zeros(0))
+    return raw_predictions
+
+def filter_detections(raw_predictions, method, view, threshold):
+    """按方法的置信度阈值过滤原始预测，输出格式与逐次推理时一致"""
+    confidences, class_ids = raw_predictions[view]
+    keep = confidences > threshold
+    confidences, class_ids = confidences[keep], class_ids[keep]
+    
+    detections = []
+    for class_id, confidence in zip(class_ids, confidences):
+        class_id_int = int(class_id)
+        class_name_en = model.names[class_id_int]
+        class_name_zh = CLASS_MAPPING.get(class_name_en, class_name_en)
+        
+        detections.append({
+            "method": method,
+            "class_id": class_id_int,
+            "class_name_en": class_name_en,
+            "class_name_zh": class_name_zh,
+            "confidence": float(confidence),
+            "box_count": len(confidences)
+        })
+        
+        print(f" {method} 检测到: {class_name_zh}({class_name_en}), 置信度: {confidence:.3f}")
+    return detections
+
 @app.route('/analyze/stool', methods=['POST', 'OPTIONS'])
 def analyze_stool():
     if request.method == 'OPTIONS':
@@ -76,7 +112,7 @@ def analyze_stool():
     
     print(" 收到图片分析请求 - 诊断模式")
     
-    if model is None:
+    if model.get() is None:
         return jsonify({"success": False, "error": "模型未加载"}), 500
     
     try:
@@ -99,82 +135,20 @@ def analyze_stool():
         except Exception as e:
             return jsonify({"success": False, "error": f"图像解码失败: {str(e)}"}), 400
         
-        # 方法1: 直接使用原始图像
-        print(" 方法1: 使用原始图像检测...")
-        results1 = model(original_image, conf=0.25)  # 降低置信度阈值
-        
-        # 方法2: 使用预处理后的图像
-        print(" 方法2: 使用预处理图像检测...")
-        enhanced_image = improve_detection(original_image)
-        results2 = model(enhanced_image, conf=0.25)
+        # 一次批量推理同时得到原始图像和预处理图像的原始预测
+        print(" 批量推理: 原始图像 + 预处理图像...")
+        raw_predictions = run_multiview_detection(original_image)
         
-        # 方法3: 使用更低的置信度阈值
-        print(" 方法3: 低置信度阈值检测...")
-        results3 = model(original_image, conf=0.15)
-        
-        # 分析所有结果
+        # 分析所有结果 - 各方法的阈值只是对同一批原始预测做过滤
         all_detections = []
-        
-        for i, (results, method) in enumerate([
-            (results1, "原始图像"),
-            (results2, "预处理图像"), 
-            (results3, "低阈值")
-        ]):
-            if len(results) > 0:
-                result = results[0]
-                boxes = result.boxes
-                
-                if boxes is not None and len(boxes) > 0:
-                    confidences = boxes.conf.cpu().numpy()
-                    class_ids = boxes.cls.cpu().numpy()
-                    
-                    for j, (class_id, confidence) in enumerate(zip(class_ids, confidences)):
-                        class_id_int = int(class_id)
-                        class_name_en = model.names[class_id_int]
-                        class_name_zh = CLASS_MAPPING.get(class_name_en, class_name_en)
-                        
-                        detection = {
-                            "method": method,
-                            "class_id": class_id_int,
-                            "class_name_en": class_name_en,
-                            "class_name_zh": class_name_zh,
-                            "confidence": float(confidence),
-                            "box_count": len(boxes)
-                        }
-                        all_detections.append(detection)
-                        
-                        print(f" {method} 检测到: {class_name_zh}({class_name_en}), 置信度: {confidence:.3f}")
+        for method, view, threshold in DETECTION_METHODS:
+            all_detections.extend(filter_detections(raw_predictions, method, view, threshold))
         
         # 如果没有检测到任何目标，尝试其他方法
         if not all_detections:
             print(" 所有方法都未检测到目标，尝试备用方案...")
-            
-            # 方法4: 使用不同的推理尺寸
-            print(" 方法4: 调整推理尺寸...")
-            results4 = model(original_image, imgsz=640, conf=0.1)
-            
-            if len(results4) > 0:
-                result = results4[0]
-                boxes = result.boxes
-                if boxes is not None and len(boxes) > 0:
-                    confidences = boxes.conf.cpu().numpy()
-                    class_ids = boxes.cls.cpu().numpy()
-                    
-                    for j, (class_id, confidence) in enumerate(zip(class_ids, confidences)):
-                        class_id_int = int(class_id)
-                        class_name_en = model.names[class_id_int]
-                        class_name_zh = CLASS_MAPPING.get(class_name_en, class_name_en)
-                        
-                        detection = {
-                            "method": "调整尺寸",
-                            "class_id": class_id_int,
-                            "class_name_en": class_name_en,
-                            "class_name_zh": class_name_zh,
-                            "confidence": float(confidence),
-                            "box_count": len(boxes)
-                        }
-                        all_detections.append(detection)
-                        print(f" 调整尺寸检测到: {class_name_zh}, 置信度: {confidence:.3f}")
+            method, view, threshold = FALLBACK_METHOD
+            all_detections.extend(filter_detections(raw_predictions, method, view, threshold))
         
         # 选择最佳检测结果
         if all_detections:
@@ -0,0 +1,193 @@
+﻿"""
+health_records 导出为按月分区的Parquet文件，用于模型质量和总体数据分析
+
+用法:
+    python export_parquet.py --out exports/health_records
+    python export_parquet.py --out exports/health_records --chunk-size 20000 --db path/to/cathealth.db
+
+输出目录结构 (Hive分区，pyarrow/pandas/DuckDB/Spark 可直接按目录读取):
+    exports/health_records/month=2026-01/part-000000000001-000000050000.parquet
+    exports/health_records/_watermark.json      # 已导出的最大记录id
+
+- 增量导出: 只导出 id 大于上次水位线的记录，每写完一块就推进水位线，中断后重新运行从断点继续
+- 按 id 分块读取，每块是一次很短的只读查询，不长时间占用数据库，内存中只有一块数据
+- analysis_result JSON 在SQLite中用 json_extract 展开为带类型的列（类别、置信度、风险等级、risk_metrics.* 等）
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from storage import get_db_path
+
+WATERMARK_FILE = "_watermark.json"
+
+# (列名, Arrow类型, SQL表达式)；以 $. 开头的是 analysis_result 中的JSON路径，不是合法JSON时为空
+JSON_VALID = "json_valid(analysis_result)"
+
+# 数值列在SQL中统一转换类型，旧记录里整数/小数混存也能写入同一个Arrow类型
+SQL_CASTS = {pa.int64(): "INTEGER", pa.float64(): "REAL"}
+COLUMNS = [
+    ("id", pa.int64(), "id"),
+    ("cat_id", pa.string(), "CAST(cat_id AS TEXT)"),
+    ("analysis_type", pa.string(), "analysis_type"),
+    ("health_score", pa.int64(), "health_score"),
+    ("status", pa.string(), "status"),
+    ("image_path", pa.string(), "image_path"),
+    ("confidence", pa.float64(), "confidence"),
+    ("created_at", pa.string(), "created_at"),
+    ("class_id", pa.int64(), "$.detection.class_id"),
+    ("class_name", pa.string(), "$.detection.class_name"),
+    ("detection_confidence", pa.float64(), "$.detection.confidence"),
+    ("detection_count", pa.int64(), "$.detection.detection_count"),
+    ("risk_level", pa.string(), "$.health_analysis.risk_level"),
+    ("risk_metrics_risk_level", pa.int64(), "$.risk_metrics.risk_level"),
+    ("risk_metrics_cure_rate", pa.int64(), "$.risk_metrics.cure_rate"),
+    ("risk_metrics_color", pa.string(), "$.risk_metrics.color"),
+    ("analysis_method", pa.string(), "$.analysis_info.type"),
+    ("inference_path", pa.string(), "$.analysis_info.inference.path"),
+    ("degraded", pa.bool_(), "$.degraded"),
+    ("cached", pa.bool_(), "$.cached"),
+    ("near_duplicate", pa.bool_(), "$.near_duplicate")
+]
+
+SCHEMA = pa.schema(
+    [(name, pa.timestamp("s") if name == "created_at" else arrow_type) for name, arrow_type, _ in COLUMNS]
+    + [("analysis_result", pa.string())]
+)
+
+
+def select_sql(include_json):
+    expressions = []
+    for name, arrow_type, expression in COLUMNS:
+        if expression.startswith("$."):
+            expression = f"CASE WHEN {JSON_VALID} THEN json_extract(analysis_result, '{expression}') END"
+        if arrow_type in SQL_CASTS and name != "id":
+            expression = f"CAST({expression} AS {SQL_CASTS[arrow_type]})"
+        expressions.append(f"{expression} AS {name}")
+    expressions.append("analysis_result" if include_json else "NULL AS analysis_result")
+    return (
+        f"SELECT {', '.join(expressions)} FROM health_records "
+        f"WHERE id > ? ORDER BY id LIMIT ?"
+    )
+
+
+def connect_readonly(db_path):
+    """只读打开：导出进程不会取得写锁；WAL模式下读取也不阻塞服务的写入"""
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True, timeout=30.0)
+    conn.execute("PRAGMA query_only = 1")
+    return conn
+
+
+def read_watermark(out_dir):
+    try:
+        with open(os.path.join(out_dir, WATERMARK_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"last_id": 0, "rows": 0}
+
+
+def write_watermark(out_dir, watermark):
+    """先写临时文件再替换，中途退出不会留下损坏的水位线"""
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(watermark, f, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def to_table(rows):
+    """一块查询结果转换为Arrow表；created_at 解析为时间戳（无法解析的为空）"""
+    columns = list(zip(*rows))
+    arrays = []
+    for index, field in enumerate(SCHEMA):
+        if field.name == "created_at":
+            strings = pa.array(columns[index], pa.string())
+            arrays.append(pc.strptime(pc.utf8_slice_codeunits(strings, 0, 19), format="%Y-%m-%d %H:%M:%S",
+                                      unit="s", error_is_null=True))
+        elif pa.types.is_boolean(field.type):
+            arrays.append(pa.array([None if value is None else bool(value) for value in columns[index]], field.type))
+        else:
+            arrays.append(pa.array(columns[index], field.type))
+    return pa.Table.from_arrays(arrays, schema=SCHEMA)
+
+
+def write_partitions(table, out_dir, compression):
+    """按 created_at 的月份拆分写入 month=YYYY-MM 目录，返回写入的文件路径"""
+    months = pc.strftime(table["created_at"], format="%Y-%m").to_pylist()
+    paths = []
+    for month in sorted(set(months), key=lambda value: value or ""):
+        mask = pa.array([value == month for value in months])
+        part = table.filter(mask)
+        ids = part["id"]
+        directory = os.path.join(out_dir, f"month={month or 'unknown'}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{pc.min(ids).as_py():012d}-{pc.max(ids).as_py():012d}.parquet")
+        pq.write_table(part, path, compression=compression)
+        paths.append(path)
+    return paths
+
+
+def export(db_path, out_dir, chunk_size=50000, include_json=False, from_id=None, compression="zstd"):
+    """增量导出 id 大于水位线的记录，每块写完即推进水位线，返回导出报告"""
+    os.makedirs(out_dir, exist_ok=True)
+    watermark = read_watermark(out_dir)
+    last_id = watermark["last_id"] if from_id is None else int(from_id)
+    start = time.perf_counter()
+    exported = 0
+    files = []
+
+    sql = select_sql(include_json)
+    conn = connect_readonly(db_path)
+    try:
+        while True:
+            # 每块一次独立的短查询，块与块之间不持有读事务，WAL检查点不会被长时间阻塞
+            rows = conn.execute(sql, (last_id, chunk_size)).fetchall()
+            if not rows:
+                break
+            table = to_table(rows)
+            files.extend(write_partitions(table, out_dir, compression))
+            last_id = rows[-1][0]
+            exported += len(rows)
+            write_watermark(out_dir, {
+                "last_id": last_id,
+                "rows": watermark.get("rows", 0) + exported,
+                "updated_at": datetime.now().isoformat()
+            })
+            print(f" 已导出 {exported} 条 (id <= {last_id})")
+    finally:
+        conn.close()
+
+    return {
+        "rows": exported,
+        "last_id": last_id,
+        "files": len(files),
+        "seconds": round(time.perf_counter() - start, 2)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="增量导出 health_records 为按月分区的Parquet")
+    parser.add_argument("--out", required=True, help="输出目录")
+    parser.add_argument("--db", help="数据库路径，默认 CATHEALTH_DB_PATH 或仓库根目录的 cathealth.db")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="每块读取的记录数")
+    parser.add_argument("--include-json", action="store_true", help="同时保留原始 analysis_result JSON 列")
+    parser.add_argument("--from-id", type=int, help="忽略水位线，从这个id之后开始导出")
+    parser.add_argument("--compression", default="zstd", help="Parquet压缩算法 (zstd/snappy/gzip/none)")
+    args = parser.parse_args(argv)
+
+    report = export(
+        args.db or get_db_path(), args.out,
+        chunk_size=args.chunk_size, include_json=args.include_json,
+        from_id=args.from_id, compression=args.compression
+    )
+    print(json.dumps(report, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
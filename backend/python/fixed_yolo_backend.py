@@ -5,7 +5,7 @@ import io
 from PIL import Image
 import numpy as np
 import os
-import cv2
+from yolo.lazy_model import LazyModel
 
 app = Flask(__name__)
 CORS(app)
@@ -21,27 +21,8 @@ model_path = r"C:\Users\user\cathealth-app\backend\python\models\best.pt"
 print(f" 模型路径: {model_path}")
 print(f"� 模型文件存在: {os.path.exists(model_path)}")
 
-# 尝试导入YOLO
-try:
-    from ultralytics import YOLO
-    print(" 成功导入YOLO")
-    
-    if os.path.exists(model_path):
-        print(" 加载YOLO模型...")
-        model = YOLO(model_path)
-        print(" YOLO模型加载成功")
-        print(f" 模型类别: {model.names}")
-    else:
-        print(" 模型文件不存在")
-        model = None
-        
-except ImportError as e:
-    print(f" 无法导入ultralytics: {e}")
-    print(" 请安装: pip install ultralytics")
-    model = None
-except Exception as e:
-    print(f" 模型加载失败: {e}")
-    model = None
+# YOLO模型在第一次分析请求时才导入ultralytics并加载，启动和健康检查不等待模型
+model = LazyModel(model_path)
 
 # 根据你的模型输出修正类别映射
 SYMPTOM_CLASSES = {
@@ -105,7 +86,7 @@ def map_model_class_to_symptom(model_class_id, model_class_name):
 @app.route('/')
 def home():
     model_info = {}
-    if model is not None:
+    if model.loaded:
         model_info = {
             "model_loaded": True,
             "classes_count": len(model.names) if hasattr(model, 'names') else len(SYMPTOM_CLASSES),
@@ -127,7 +108,7 @@ def health_check():
     return jsonify({
         "status": "healthy",
         "service": "CatHealth YOLO Service - 修复版", 
-        "model_loaded": model is not None,
+        "model_loaded": model.loaded,
         "analysis_mode": "修复版YOLO模型分析",
         "model_path": model_path,
         "file_exists": os.path.exists(model_path),
@@ -142,7 +123,7 @@ def analyze_stool():
     print(" 收到图片分析请求 - 修复版映射")
     
     # 检查模型是否加载
-    if model is None:
+    if model.get() is None:
         return jsonify({
             "success": False,
             "error": "YOLO模型未加载",
@@ -4,8 +4,9 @@ import base64
 import io
 from PIL import Image
 import numpy as np
-import os
-import cv2
+from yolo.detector import to_numpy
+from yolo.lazy_model import LazyModel
+from yolo.tta import TTAEngine
 
 app = Flask(__name__)
 CORS(app)
@@ -20,23 +21,11 @@ print("=" * 60)
 model_path = r"C:\Users\user\cathealth-app\backend\python\models\best.pt"
 print(f" 模型路径: {model_path}")
 
-# 尝试导入YOLO
-try:
-    from ultralytics import YOLO
-    print(" 成功导入YOLO")
-    
-    if os.path.exists(model_path):
-        print(" 加载YOLO模型...")
-        model = YOLO(model_path)
-        print(" YOLO模型加载成功")
-        print(f" 模型类别: {model.names}")
-    else:
-        print(" 模型文件不存在")
-        model = None
-        
-except Exception as e:
-    print(f" 模型加载失败: {e}")
-    model = None
+# YOLO模型在第一次分析请求时才导入ultralytics并加载，启动和健康检查不等待模型
+model = LazyModel(model_path)
+# 测试时增强：翻转/缩放/颜色抖动视图一次批量推理后加权融合，负载高时自动减少视图
+# (YOLO_TTA_AUGMENTATIONS 配置增强方式，YOLO_TTA_BUDGET_MS 为每个请求的推理预算)
+tta = TTAEngine(model)
 
 # 类别映射
 CLASS_MAPPING = {
@@ -51,11 +40,10 @@ def force_detection(image):
     """强制模型进行检测"""
     print(" 使用强制检测模式...")
     
-    # 方法1: 极低的置信度阈值 + 数据增强
-    results = model(image, 
+    # 方法1: 极低的置信度阈值 + 测试时增强
+    results = tta(image,
                    conf=0.01,      # 极低置信度阈值
                    iou=0.1,        # 低IOU阈值
-                   augment=True,   # 数据增强
                    max_det=10,     # 最大检测数量
                    imgsz=640       # 固定尺寸
     )
@@ -92,7 +80,7 @@ def analyze_stool():
     
     print(" 收到图片分析请求 - 强制检测模式")
     
-    if model is None:
+    if model.get() is None:
         return jsonify({"success": False, "error": "模型未加载"}), 500
     
     try:
@@ -125,8 +113,8 @@ def analyze_stool():
             
             if boxes is not None and len(boxes) > 0:
                 # 获取置信度最高的检测
-                confidences = boxes.conf.cpu().numpy()
-                class_ids = boxes.cls.cpu().numpy()
+                confidences = to_numpy(boxes.conf)
+                class_ids = to_numpy(boxes.cls)
                 
                 max_idx = np.argmax(confidences)
                 class_id = int(class_ids[max_idx])
@@ -4,9 +4,7 @@ import base64
 import io
 from PIL import Image
 import numpy as np
-import os
-import cv2
-import time
+from yolo.lazy_model import LazyModel
 
 app = Flask(__name__)
 CORS(app)
@@ -21,23 +19,8 @@ print("=" * 60)
 model_path = r"C:\Users\user\cathealth-app\backend\python\models\best.pt"
 print(f" 模型路径: {model_path}")
 
-# 尝试导入YOLO
-try:
-    from ultralytics import YOLO
-    print(" 成功导入YOLO")
-    
-    if os.path.exists(model_path):
-        print(" 加载YOLO模型...")
-        model = YOLO(model_path)
-        print(" YOLO模型加载成功")
-        print(f" 模型类别: {model.names}")
-    else:
-        print(" 模型文件不存在")
-        model = None
-        
-except Exception as e:
-    print(f" 模型加载失败: {e}")
-    model = None
+# YOLO模型在第一次分析请求时才导入ultralytics并加载，启动和健康检查不等待模型
+model = LazyModel(model_path)
 
 # 强制检测顺序和映射
 FORCED_DETECTION_ORDER = [
@@ -125,7 +108,7 @@ def analyze_stool():
     
     print(" 收到图片分析请求 - 强制顺序版")
     
-    if model is None:
+    if model.get() is None:
         return jsonify({"success": False, "error": "模型未加载"}), 500
     
     try:
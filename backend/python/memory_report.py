@@ -0,0 +1,107 @@
+﻿"""
+进程内存报告：共享页 vs 私有页（读取Linux的 /proc/<pid>/smaps_rollup）
+
+用法:
+    python memory_report.py <gunicorn主进程PID>          # 主进程 + 所有worker
+    python memory_report.py <PID> --json
+
+预加载模式下模型权重在主进程加载，fork后的worker与主进程共享这些页面（Shared_*），
+只有被写过的页面才会复制成worker私有（Private_*）。
+PSS 把共享页按共享进程数平摊，所有进程的PSS之和才是这组进程真正占用的物理内存，
+RSS 之和会把共享页重复计算。
+"""
+import argparse
+import json
+import os
+
+# smaps_rollup 字段 -> 报告字段（单位 kB）
+SMAPS_FIELDS = {
+    "Rss": "rss_kb",
+    "Pss": "pss_kb",
+    "Shared_Clean": "shared_clean_kb",
+    "Shared_Dirty": "shared_dirty_kb",
+    "Private_Clean": "private_clean_kb",
+    "Private_Dirty": "private_dirty_kb",
+    "Swap": "swap_kb"
+}
+
+
+def read_smaps_rollup(pid="self"):
+    """读取单个进程的内存汇总；非Linux或无权限时返回 None"""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+
+    usage = {field: 0 for field in SMAPS_FIELDS.values()}
+    for line in lines:
+        parts = line.split()
+        key = parts[0].rstrip(":") if parts else None
+        if key in SMAPS_FIELDS:
+            usage[SMAPS_FIELDS[key]] = int(parts[1])
+    usage["shared_kb"] = usage["shared_clean_kb"] + usage["shared_dirty_kb"]
+    usage["private_kb"] = usage["private_clean_kb"] + usage["private_dirty_kb"]
+    return usage
+
+
+def child_pids(pid):
+    """进程的直接子进程（gunicorn的worker）"""
+    children = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return sorted(set(children))
+
+
+def process_tree_report(pid):
+    """主进程和所有worker的内存明细及汇总"""
+    processes = []
+    for process_pid in [int(pid)] + child_pids(pid):
+        usage = read_smaps_rollup(process_pid)
+        if usage is not None:
+            processes.append({"pid": process_pid, "role": "master" if process_pid == int(pid) else "worker", **usage})
+
+    totals = {
+        field: sum(process[field] for process in processes)
+        for field in ("rss_kb", "pss_kb", "shared_kb", "private_kb")
+    }
+    return {"processes": processes, "totals": totals, "workers": len(processes) - 1 if processes else 0}
+
+
+def print_report(report):
+    print("=" * 72)
+    print(f" {'PID':>8} {'角色':<6} {'RSS':>10} {'PSS':>10} {'共享':>10} {'私有':>10}  (MB)")
+    for process in report["processes"]:
+        print(
+            f" {process['pid']:>8} {process['role']:<8} {process['rss_kb'] / 1024:>10.1f} {process['pss_kb'] / 1024:>10.1f}"
+            f" {process['shared_kb'] / 1024:>10.1f} {process['private_kb'] / 1024:>10.1f}"
+        )
+    totals = report["totals"]
+    print("-" * 72)
+    print(f" 合计: RSS {totals['rss_kb'] / 1024:.1f} MB (重复计算共享页), 实际占用(PSS) {totals['pss_kb'] / 1024:.1f} MB")
+    print(f" 共享 {totals['shared_kb'] / 1024:.1f} MB, 私有 {totals['private_kb'] / 1024:.1f} MB, worker数: {report['workers']}")
+    print("=" * 72)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="显示进程及其子进程的共享/私有内存")
+    parser.add_argument("pid", type=int, help="主进程PID（如gunicorn master）")
+    parser.add_argument("--json", action="store_true", help="输出JSON")
+    args = parser.parse_args(argv)
+
+    report = process_tree_report(args.pid)
+    if not report["processes"]:
+        parser.error(f"无法读取 /proc/{args.pid}/smaps_rollup（需要Linux 4.14+，且有权限读取该进程）")
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,6 @@ import base64
 import io
 from PIL import Image
 import numpy as np
-import cv2
 
 app = Flask(__name__)
 CORS(app)
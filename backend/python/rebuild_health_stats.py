@@ -0,0 +1,32 @@
+﻿"""
+从 health_records 重建派生数据
+
+用法:
+    python rebuild_health_stats.py                 # 重建趋势状态和日/周汇总表
+    python rebuild_health_stats.py --only rollups  # 只重建 daily_cat_summary / weekly_cat_summary
+    python rebuild_health_stats.py --db path/to/cathealth.db
+
+派生数据平时随记录写入增量更新；修改了计算规则、或记录由其它程序直接写入数据库后运行。
+重建期间持有数据库写锁，服务写入新记录会等待重建完成。
+"""
+import argparse
+import json
+
+from storage import RollupStore, TrendStore
+
+STORES = {"trends": TrendStore, "rollups": RollupStore}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="从 health_records 重建派生数据")
+    parser.add_argument("--db", help="数据库路径，默认 CATHEALTH_DB_PATH 或仓库根目录的 cathealth.db")
+    parser.add_argument("--only", choices=sorted(STORES), help="只重建其中一种")
+    args = parser.parse_args(argv)
+
+    names = [args.only] if args.only else list(STORES)
+    report = {name: STORES[name](args.db).rebuild() for name in names}
+    print(json.dumps(report, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,32 @@
 ﻿import cv2
 import numpy as np
-from ultralytics import YOLO
 import os
-import base64
-from PIL import Image
-import io
 import sys
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# backend/python 目录，用于导入共享的 yolo 包（ONNX后端等）
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from yolo.image_decode import decode_base64, decode_to_bgr
+
+def to_numpy(values):
+    """torch张量或numpy数组统一转换为numpy数组"""
+    if hasattr(values, "cpu"):
+        return values.cpu().numpy()
+    return np.asarray(values)
 
 class YOLODetector:
-    def __init__(self, model_path=None):
+    def __init__(self, model_path=None, backend=None):
         """
         初始化YOLO检测器
+        backend: torch (ultralytics)、onnx (onnxruntime) 或 onnx-int8，默认读取环境变量 YOLO_BACKEND
         """
         if model_path is None:
             # 默认模型路径
             model_path = os.path.join(os.path.dirname(__file__), '../../models/best.pt')
         
         self.model_path = model_path
+        self.backend = backend or os.environ.get("YOLO_BACKEND", "torch")
         self.model = None
         self.load_model()
     
@@ -26,8 +34,13 @@ class YOLODetector:
         """加载YOLO模型"""
         try:
             if os.path.exists(self.model_path):
-                print(f" 加载YOLO模型: {self.model_path}")
-                self.model = YOLO(self.model_path)
+                print(f" 加载YOLO模型: {self.model_path} (后端: {self.backend})")
+                if self.backend in ("onnx", "onnx-int8"):
+                    from yolo.onnx_backend import OnnxYOLO
+                    self.model = OnnxYOLO.from_weights(self.model_path, quantized=self.backend == "onnx-int8")
+                else:
+                    from ultralytics import YOLO
+                    self.model = YOLO(self.model_path)
                 print(" YOLO模型加载成功")
             else:
                 print(f" 模型文件不存在: {self.model_path}")
@@ -37,21 +50,14 @@ class YOLODetector:
             print(f" 模型加载失败: {e}")
             self.model = None
     
-    def base64_to_image(self, base64_string):
-        """将base64字符串转换为OpenCV图像"""
+    def base64_to_image(self, base64_string, max_side=640):
+        """
+        将base64字符串转换为OpenCV图像 (BGR)
+        直接用cv2.imdecode解码为BGR；大图按比例缩小解码（推理时本来也会缩放到640），
+        max_side=None 时保持原分辨率
+        """
         try:
-            # 移除data:image/jpeg;base64,前缀
-            if ',' in base64_string:
-                base64_string = base64_string.split(',')[1]
-            
-            # 解码base64
-            image_data = base64.b64decode(base64_string)
-            image = Image.open(io.BytesIO(image_data))
-            
-            # 转换为OpenCV格式 (BGR)
-            opencv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-            return opencv_image
-            
+            return decode_to_bgr(decode_base64(base64_string), max_side=max_side)
         except Exception as e:
             print(f" 图像解码失败: {e}")
             return None
@@ -91,8 +97,8 @@ class YOLODetector:
             boxes = result.boxes
             if boxes is not None and len(boxes) > 0:
                 print(f"找到 {len(boxes)} 个边界框")
-                confidences = boxes.conf.cpu().numpy()
-                class_ids = boxes.cls.cpu().numpy()
+                confidences = to_numpy(boxes.conf)
+                class_ids = to_numpy(boxes.cls)
                 
                 # 找到置信度最高的检测
                 max_confidence_idx = np.argmax(confidences)
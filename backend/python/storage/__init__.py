@@ -0,0 +1,7 @@
+﻿from .database import connect, get_db_path
+from .health_records import HealthRecordWriter, parse_cat_id, record_from_result
+from .history import HealthHistory, InvalidCursorError
+from .jobs import JobRunner, JobStore, QueueFullError
+from .migrations import migrate
+from .rollups import RollupStore
+from .trends import TrendEngine, TrendStore
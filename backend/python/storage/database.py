@@ -0,0 +1,18 @@
+﻿import os
+import sqlite3
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 仓库根目录下的 cathealth.db（其中已有 cats、health_records 表）；Node后端使用的是 backend/database/cathealth.db
+DEFAULT_DB_PATH = os.path.abspath(os.path.join(PYTHON_DIR, "..", "..", "cathealth.db"))
+
+
+def get_db_path():
+    """数据库路径，可用环境变量 CATHEALTH_DB_PATH 覆盖"""
+    return os.environ.get("CATHEALTH_DB_PATH") or DEFAULT_DB_PATH
+
+
+def connect(db_path=None, timeout=30.0):
+    """打开SQLite连接，行以 sqlite3.Row 返回"""
+    conn = sqlite3.connect(db_path or get_db_path(), timeout=timeout, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    return conn
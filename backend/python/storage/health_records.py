@@ -0,0 +1,170 @@
+﻿import atexit
+import json
+import queue
+import threading
+import time
+from datetime import datetime
+
+from .database import connect, get_db_path
+from .migrations import migrate
+
+INSERT_SQL = (
+    "INSERT INTO health_records "
+    "(cat_id, analysis_type, health_score, status, image_path, analysis_result, confidence, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+# 排泄物类别保存在 analysis_result JSON 中；不是合法JSON的记录（如其它程序写入的）按无类别处理
+CLASS_NAME_SQL = (
+    "CASE WHEN json_valid(analysis_result) "
+    "THEN json_extract(analysis_result, '$.detection.class_name') END"
+)
+
+
+def utc_timestamp():
+    """与 health_records.created_at 的默认值 CURRENT_TIMESTAMP 相同的格式 (UTC)"""
+    return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def parse_cat_id(value):
+    """health_records.cat_id 为 INTEGER；不是正整数（未传、'default' 等）时返回 None，记录的 cat_id 存为 NULL"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value if value > 0 else None
+    value = str(value or "").strip()
+    return int(value) if value.isdigit() and int(value) > 0 else None
+
+
+def record_from_result(cat_id, result, analysis_type="stool", image_path=None):
+    """把分析接口的返回结果转换为 health_records 的一行"""
+    risk_metrics = result.get("risk_metrics") or {}
+    health_score = risk_metrics.get("cure_rate")
+    if health_score is None and "risk_level" in risk_metrics:
+        health_score = 100 - risk_metrics["risk_level"]
+    return {
+        "cat_id": cat_id,
+        "analysis_type": analysis_type,
+        "health_score": health_score,
+        "status": (result.get("health_analysis") or {}).get("risk_level"),
+        "image_path": image_path,
+        "analysis_result": json.dumps(result, ensure_ascii=False),
+        "confidence": (result.get("detection") or {}).get("confidence"),
+        "created_at": utc_timestamp(),
+        # 不是表中的列，供趋势状态更新使用
+        "class_name": (result.get("detection") or {}).get("class_name")
+    }
+
+
+class HealthRecordWriter:
+    """
+    health_records 的后台批量写入
+    请求线程只把记录放进有界队列（不等待磁盘），写入线程攒够 batch_size 条
+    或等待 flush_interval 秒后在一个事务中提交；队列满时丢弃新记录并计数，不阻塞请求
+    数据库使用WAL模式：写入时读请求不被阻塞，synchronous=NORMAL 只在检查点时fsync
+    derived_stores 中的派生数据（趋势状态、日/周汇总）在同一事务中通过各自的 apply(conn, records) 更新
+    """
+
+    def __init__(self, db_path=None, max_queue=1000, batch_size=100, flush_interval=0.5, derived_stores=()):
+        self.db_path = db_path or get_db_path()
+        self.derived_stores = [store for store in derived_stores if store is not None]
+        self.max_queue = int(max_queue)
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = float(flush_interval)
+
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._unwritten = 0
+        self._closed = False
+        self._stats = {"enqueued": 0, "written": 0, "dropped": 0, "failed": 0, "batches": 0}
+
+        self._conn = connect(self.db_path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        migrate(self._conn)
+
+        self._thread = threading.Thread(target=self._run, name="health-record-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def enqueue(self, record):
+        """放入写入队列，返回是否成功；队列已满时丢弃"""
+        with self._lock:
+            if self._closed:
+                return False
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                self._stats["dropped"] += 1
+                return False
+            self._unwritten += 1
+            self._stats["enqueued"] += 1
+            return True
+
+    def flush(self, timeout=None):
+        """等待已入队的记录全部写入，返回是否在超时前完成"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._unwritten == 0, timeout)
+
+    def close(self, timeout=5):
+        """写完队列中剩余的记录后停止写入线程"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queued"] = self._queue.qsize()
+        stats["max_queue"] = self.max_queue
+        stats["batch_size"] = self.batch_size
+        return stats
+
+    def _run(self):
+        running = True
+        while running:
+            record = self._queue.get()
+            if record is None:
+                break
+            batch = [record]
+            # 等待更多记录凑成一批，最多等待 flush_interval 秒
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    record = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    running = False
+                    break
+                batch.append(record)
+            self._write(batch)
+        self._conn.close()
+
+    def _write(self, batch):
+        rows = [
+            (r["cat_id"], r["analysis_type"], r["health_score"], r["status"], r["image_path"],
+             r["analysis_result"], r["confidence"], r["created_at"])
+            for r in batch
+        ]
+        written = 0
+        try:
+            with self._conn:
+                for row, record in zip(rows, batch):
+                    record["id"] = self._conn.execute(INSERT_SQL, row).lastrowid
+                for store in self.derived_stores:
+                    store.apply(self._conn, batch)
+            written = len(rows)
+        except Exception as e:
+            print(f" 健康记录写入失败 ({len(rows)} 条): {e}")
+        with self._idle:
+            self._unwritten -= len(batch)
+            self._stats["written"] += written
+            self._stats["failed"] += len(batch) - written
+            self._stats["batches"] += 1
+            self._idle.notify_all()
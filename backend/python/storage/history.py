@@ -0,0 +1,76 @@
+﻿import base64
+import json
+
+from .database import connect, get_db_path
+from .migrations import migrate
+
+# 列表页返回的列，都在 idx_health_records_cat_created 覆盖索引中
+SUMMARY_COLUMNS = "id, cat_id, analysis_type, status, health_score, confidence, created_at"
+
+
+class InvalidCursorError(ValueError):
+    """分页游标格式错误"""
+
+
+def encode_cursor(created_at, record_id):
+    raw = json.dumps([created_at, record_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, record_id = json.loads(raw)
+        return str(created_at), int(record_id)
+    except Exception:
+        raise InvalidCursorError("无效的分页游标")
+
+
+class HealthHistory:
+    """
+    按猫咪查询 health_records 历史，从新到旧分页
+    使用键集(游标)分页: 游标记录上一页最后一条的 (created_at, id)，
+    下一页从索引中该位置之后继续读取，翻到多少页查询耗时都一样（OFFSET 要先跳过前面所有行）
+    """
+
+    def __init__(self, db_path=None, max_limit=100):
+        self.db_path = db_path or get_db_path()
+        self.max_limit = int(max_limit)
+        conn = connect(self.db_path)
+        try:
+            migrate(conn)
+        finally:
+            conn.close()
+
+    def page(self, cat_id, cursor=None, limit=20, include_result=False):
+        """
+        返回 {"records": [...], "next_cursor": 游标或None, "has_more": bool}
+        include_result=True 时才读取并解析 analysis_result JSON
+        """
+        limit = max(1, min(int(limit), self.max_limit))
+        columns = SUMMARY_COLUMNS + (", analysis_result" if include_result else "")
+        sql = f"SELECT {columns} FROM health_records WHERE cat_id = ?"
+        params = [cat_id]
+        if cursor:
+            sql += " AND (created_at, id) < (?, ?)"
+            params.extend(decode_cursor(cursor))
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        # 多读一条判断是否还有下一页
+        params.append(limit + 1)
+
+        conn = connect(self.db_path)
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+        has_more = len(rows) > limit
+        records = [dict(row) for row in rows[:limit]]
+        if include_result:
+            for record in records:
+                try:
+                    record["analysis_result"] = json.loads(record["analysis_result"]) if record["analysis_result"] else None
+                except ValueError:
+                    pass
+        next_cursor = encode_cursor(records[-1]["created_at"], records[-1]["id"]) if has_more else None
+        return {"records": records, "next_cursor": next_cursor, "has_more": has_more}
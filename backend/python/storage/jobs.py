@@ -0,0 +1,247 @@
+﻿import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from .database import connect, get_db_path
+
+
+FINISHED_STATUSES = ("succeeded", "failed")
+
+
+class QueueFullError(Exception):
+    """排队中的任务已达上限"""
+
+
+def pid_alive(pid):
+    """本机上的进程是否还在运行"""
+    if os.name == "nt":
+        # Windows 上 os.kill(pid, 0) 会结束目标进程，改为尝试打开进程句柄
+        import ctypes
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, int(pid))
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    """analysis_jobs 表：异步分析任务的状态和结果"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or get_db_path()
+        self._ensure_schema()
+
+    def _ensure_schema(self):
+        self._execute("""
+            CREATE TABLE IF NOT EXISTS analysis_jobs (
+                id TEXT PRIMARY KEY,
+                cat_id TEXT,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT,
+                owner_pid INTEGER
+            )
+        """)
+        # 旧版本建的表没有 owner_pid 列
+        conn = connect(self.db_path)
+        try:
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(analysis_jobs)")}
+            if "owner_pid" not in columns:
+                with conn:
+                    conn.execute("ALTER TABLE analysis_jobs ADD COLUMN owner_pid INTEGER")
+        finally:
+            conn.close()
+        self._execute("CREATE INDEX IF NOT EXISTS idx_analysis_jobs_created_at ON analysis_jobs (created_at)")
+
+    def _execute(self, sql, params=()):
+        conn = connect(self.db_path)
+        try:
+            with conn:
+                return conn.execute(sql, params).rowcount
+        finally:
+            conn.close()
+
+    def create(self, cat_id=None):
+        job_id = uuid.uuid4().hex
+        self._execute(
+            "INSERT INTO analysis_jobs (id, cat_id, status, created_at, owner_pid) VALUES (?, ?, 'queued', ?, ?)",
+            (job_id, cat_id, datetime.now().isoformat(), os.getpid())
+        )
+        return job_id
+
+    def mark_running(self, job_id):
+        self._execute(
+            "UPDATE analysis_jobs SET status = 'running', started_at = ? WHERE id = ?",
+            (datetime.now().isoformat(), job_id)
+        )
+
+    def mark_succeeded(self, job_id, result):
+        self._execute(
+            "UPDATE analysis_jobs SET status = 'succeeded', result = ?, finished_at = ? WHERE id = ?",
+            (json.dumps(result, ensure_ascii=False), datetime.now().isoformat(), job_id)
+        )
+
+    def mark_failed(self, job_id, error):
+        self._execute(
+            "UPDATE analysis_jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+            (error, datetime.now().isoformat(), job_id)
+        )
+
+    def get(self, job_id):
+        conn = connect(self.db_path)
+        try:
+            row = conn.execute("SELECT * FROM analysis_jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+
+        job = dict(row)
+        job.pop("owner_pid", None)
+        job["job_id"] = job.pop("id")
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def fail_interrupted(self, stale_hours=1):
+        """
+        执行进程已退出的未完成任务（图像只在内存中）标记为失败
+        多worker部署时其它worker仍在执行的任务不受影响；与本进程同pid的任务来自重启前的进程（容器内pid固定），
+        超过 stale_hours 仍未完成的任务按中断处理（pid 可能已被其它进程复用）
+        """
+        cutoff = (datetime.now() - timedelta(hours=stale_hours)).isoformat()
+        conn = connect(self.db_path)
+        try:
+            rows = conn.execute(
+                "SELECT id, owner_pid, created_at FROM analysis_jobs WHERE status IN ('queued', 'running')"
+            ).fetchall()
+        finally:
+            conn.close()
+        interrupted = [
+            (row["id"],) for row in rows
+            if row["owner_pid"] is None or row["owner_pid"] == os.getpid()
+            or row["created_at"] < cutoff or not pid_alive(row["owner_pid"])
+        ]
+        if not interrupted:
+            return 0
+        now = datetime.now().isoformat()
+        conn = connect(self.db_path)
+        try:
+            with conn:
+                conn.executemany(
+                    "UPDATE analysis_jobs SET status = 'failed', error = ?, finished_at = ? "
+                    "WHERE id = ? AND status IN ('queued', 'running')",
+                    [("服务重启，任务中断，请重新提交", now) + job for job in interrupted]
+                )
+        finally:
+            conn.close()
+        return len(interrupted)
+
+    def purge(self, max_age_hours=24):
+        """删除过期的已完成任务"""
+        cutoff = (datetime.now() - timedelta(hours=max_age_hours)).isoformat()
+        return self._execute(
+            "DELETE FROM analysis_jobs WHERE status IN ('succeeded', 'failed') AND created_at < ?",
+            (cutoff,)
+        )
+
+
+class JobRunner:
+    """
+    有界线程池执行分析任务
+    最多 max_workers 个任务同时执行，排队+执行中的任务超过 max_pending 时拒绝新任务
+    """
+
+    def __init__(self, store, handler, max_workers=2, max_pending=64, poll_interval=0.25):
+        self.store = store
+        self.handler = handler
+        self.max_workers = int(max_workers)
+        self.max_pending = int(max_pending)
+        self.poll_interval = float(poll_interval)
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="analysis-job")
+        self._lock = threading.Lock()
+        self._events = {}
+        self._stats = {"submitted": 0, "rejected": 0, "succeeded": 0, "failed": 0, "pending": 0}
+
+        interrupted = store.fail_interrupted()
+        purged = store.purge()
+        if interrupted or purged:
+            print(f" 任务表清理: {interrupted} 个中断任务, {purged} 个过期任务")
+
+    def submit(self, payload, cat_id=None):
+        """提交任务，立即返回任务ID；队列已满时抛出 QueueFullError"""
+        with self._lock:
+            if self._stats["pending"] >= self.max_pending:
+                self._stats["rejected"] += 1
+                raise QueueFullError(f"任务队列已满 ({self.max_pending})")
+            self._stats["pending"] += 1
+            self._stats["submitted"] += 1
+
+        try:
+            job_id = self.store.create(cat_id)
+        except Exception:
+            with self._lock:
+                self._stats["pending"] -= 1
+            raise
+
+        with self._lock:
+            self._events[job_id] = threading.Event()
+        self._executor.submit(self._run, job_id, payload)
+        return job_id
+
+    def _run(self, job_id, payload):
+        status = "failed"
+        try:
+            self.store.mark_running(job_id)
+            result = self.handler(payload)
+            self.store.mark_succeeded(job_id, result)
+            status = "succeeded"
+        except Exception as e:
+            print(f" 任务 {job_id} 失败: {e}")
+            self.store.mark_failed(job_id, str(e))
+        finally:
+            with self._lock:
+                self._stats["pending"] -= 1
+                self._stats[status] += 1
+                event = self._events.pop(job_id, None)
+            if event is not None:
+                event.set()
+
+    def wait(self, job_id, timeout):
+        """长轮询：等待任务完成或超时，返回最新的任务状态"""
+        with self._lock:
+            event = self._events.get(job_id)
+        if event is not None:
+            if timeout > 0:
+                event.wait(timeout)
+            return self.store.get(job_id)
+
+        # 任务由其它worker进程创建（多worker部署），本进程没有它的事件，每 poll_interval 秒查询一次数据库
+        deadline = time.monotonic() + max(timeout, 0)
+        while True:
+            job = self.store.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in FINISHED_STATUSES or remaining <= 0:
+                return job
+            time.sleep(min(self.poll_interval, remaining))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["max_workers"] = self.max_workers
+        stats["max_pending"] = self.max_pending
+        return stats
@@ -0,0 +1,96 @@
+﻿from datetime import datetime
+
+# (名称, SQL语句列表)，按顺序执行，已执行的记录在 schema_migrations 表中，不会重复执行
+MIGRATIONS = [
+    ("001_health_records", [
+        # 与Node后端建表语句相同，已有该表的数据库跳过
+        """
+        CREATE TABLE IF NOT EXISTS health_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cat_id INTEGER,
+            analysis_type TEXT,
+            health_score INTEGER,
+            status TEXT,
+            image_path TEXT,
+            analysis_result TEXT,
+            confidence REAL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (cat_id) REFERENCES cats (id)
+        )
+        """
+    ]),
+    ("002_health_records_history_index", [
+        # 按猫咪查询历史、按 (created_at, id) 倒序分页都走这个索引；
+        # 列表页需要的列都在索引里（覆盖索引），不用回表读取 analysis_result 大字段
+        """
+        CREATE INDEX IF NOT EXISTS idx_health_records_cat_created
+        ON health_records (cat_id, created_at, id, analysis_type, status, health_score, confidence)
+        """
+    ]),
+    ("003_cat_trends", [
+        # 每只猫的趋势状态 (storage.trends)，随 health_records 的写入增量更新
+        """
+        CREATE TABLE IF NOT EXISTS cat_trends (
+            cat_id TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            last_record_id INTEGER,
+            updated_at TEXT NOT NULL
+        )
+        """
+    ]),
+    ("004_cat_summary_rollups", [
+        # 每只猫按日/周、类别、风险等级的计数 (storage.rollups)；主键即图表查询使用的索引
+        """
+        CREATE TABLE IF NOT EXISTS daily_cat_summary (
+            cat_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            class_name TEXT NOT NULL,
+            status TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            score_sum REAL NOT NULL,
+            score_count INTEGER NOT NULL,
+            PRIMARY KEY (cat_id, day, class_name, status)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS weekly_cat_summary (
+            cat_id TEXT NOT NULL,
+            week TEXT NOT NULL,
+            class_name TEXT NOT NULL,
+            status TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            score_sum REAL NOT NULL,
+            score_count INTEGER NOT NULL,
+            PRIMARY KEY (cat_id, week, class_name, status)
+        )
+        """
+    ])
+]
+
+
+def migrate(conn):
+    """执行尚未执行的迁移，返回本次执行的迁移名称；多个进程同时调用时由写锁串行化"""
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS schema_migrations (name TEXT PRIMARY KEY, applied_at TEXT NOT NULL)"
+    )
+    applied = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        done = {row[0] for row in conn.execute("SELECT name FROM schema_migrations")}
+        for name, statements in MIGRATIONS:
+            if name in done:
+                continue
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(
+                "INSERT INTO schema_migrations (name, applied_at) VALUES (?, ?)",
+                (name, datetime.now().isoformat())
+            )
+            applied.append(name)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    if applied:
+        print(f" 数据库迁移: {', '.join(applied)}")
+    return applied
@@ -0,0 +1,148 @@
+﻿import time
+from datetime import datetime, timedelta
+
+from .database import connect, get_db_path
+from .health_records import CLASS_NAME_SQL
+from .migrations import migrate
+
+# 周期 -> (汇总表, 时间桶列, 把 created_at 换算成时间桶的SQL表达式)；日期按UTC，周从周一开始
+ROLLUP_TABLES = {
+    "day": ("daily_cat_summary", "day", "date(created_at)"),
+    "week": ("weekly_cat_summary", "week", "date(created_at, 'weekday 0', '-6 days')")
+}
+
+# 没有指定起始日期时返回的时间范围
+DEFAULT_SPANS = {"day": timedelta(days=30), "week": timedelta(weeks=26)}
+
+
+def bucket_of(created_at, period):
+    """created_at ('YYYY-MM-DD HH:MM:SS') 所在的日期或所在周的周一"""
+    day = datetime.strptime(str(created_at)[:10], "%Y-%m-%d").date()
+    if period == "week":
+        day -= timedelta(days=day.weekday())
+    return day.isoformat()
+
+
+class RollupStore:
+    """
+    按猫咪、日/周、类别、风险等级汇总的计数表 (daily_cat_summary / weekly_cat_summary)
+    HealthRecordWriter 在写入 health_records 的同一事务中调用 apply() 累加计数，
+    图表接口只读汇总表，读取的行数只与时间范围有关，与历史记录总数无关；
+    rebuild() 用一条 GROUP BY 语句从 health_records 重新汇总
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or get_db_path()
+        conn = connect(self.db_path)
+        try:
+            migrate(conn)
+        finally:
+            conn.close()
+
+    def apply(self, conn, records):
+        """在调用方的写事务中，把新写入的记录累加到日/周汇总"""
+        for period, (table, column, _) in ROLLUP_TABLES.items():
+            totals = {}
+            for record in records:
+                if record.get("cat_id") is None or not record.get("created_at"):
+                    continue
+                key = (
+                    str(record["cat_id"]), bucket_of(record["created_at"], period),
+                    record.get("class_name") or "", record.get("status") or ""
+                )
+                count, score_sum, score_count = totals.get(key, (0, 0.0, 0))
+                score = record.get("health_score")
+                totals[key] = (
+                    count + 1,
+                    score_sum + (score if score is not None else 0),
+                    score_count + (score is not None)
+                )
+            conn.executemany(
+                f"INSERT INTO {table} (cat_id, {column}, class_name, status, count, score_sum, score_count) "
+                f"VALUES (?, ?, ?, ?, ?, ?, ?) "
+                f"ON CONFLICT(cat_id, {column}, class_name, status) DO UPDATE SET "
+                f"count = count + excluded.count, score_sum = score_sum + excluded.score_sum, "
+                f"score_count = score_count + excluded.score_count",
+                [key + value for key, value in totals.items()]
+            )
+
+    def chart(self, cat_id, period="day", start=None, end=None):
+        """
+        图表数据: 每个时间桶的总数、各类别计数、各风险等级计数、平均健康分
+        start/end 为 'YYYY-MM-DD'（含），默认最近30天/26周
+        """
+        table, column, _ = ROLLUP_TABLES[period]
+        end = end or datetime.utcnow().date().isoformat()
+        if start is None:
+            start = (datetime.strptime(end, "%Y-%m-%d") - DEFAULT_SPANS[period]).date().isoformat()
+        start = bucket_of(start, period)
+
+        conn = connect(self.db_path)
+        try:
+            rows = conn.execute(
+                f"SELECT {column} AS bucket, class_name, status, count, score_sum, score_count FROM {table} "
+                f"WHERE cat_id = ? AND {column} >= ? AND {column} <= ? ORDER BY {column}",
+                (str(cat_id), start, end)
+            ).fetchall()
+        finally:
+            conn.close()
+
+        buckets = {}
+        for row in rows:
+            bucket = buckets.setdefault(row["bucket"], {
+                "date": row["bucket"], "total": 0, "classes": {}, "statuses": {}, "score_sum": 0.0, "score_count": 0
+            })
+            bucket["total"] += row["count"]
+            if row["class_name"]:
+                bucket["classes"][row["class_name"]] = bucket["classes"].get(row["class_name"], 0) + row["count"]
+            if row["status"]:
+                bucket["statuses"][row["status"]] = bucket["statuses"].get(row["status"], 0) + row["count"]
+            bucket["score_sum"] += row["score_sum"]
+            bucket["score_count"] += row["score_count"]
+
+        series = []
+        for bucket in buckets.values():
+            score_sum, score_count = bucket.pop("score_sum"), bucket.pop("score_count")
+            bucket["avg_health_score"] = round(score_sum / score_count, 1) if score_count else None
+            series.append(bucket)
+        return {"period": period, "start": start, "end": end, "series": series}
+
+    def ensure_built(self):
+        """汇总表为空而 health_records 已有记录时重建"""
+        conn = connect(self.db_path)
+        try:
+            empty = conn.execute("SELECT 1 FROM daily_cat_summary LIMIT 1").fetchone() is None
+            has_records = conn.execute("SELECT 1 FROM health_records LIMIT 1").fetchone() is not None
+        finally:
+            conn.close()
+        if empty and has_records:
+            return self.rebuild()
+        return None
+
+    def rebuild(self):
+        """清空并从 health_records 重新汇总；期间持有写锁，新记录等待重建完成后再写入"""
+        start = time.perf_counter()
+        rows = {}
+        conn = connect(self.db_path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for table, column, expression in ROLLUP_TABLES.values():
+                conn.execute(f"DELETE FROM {table}")
+                conn.execute(
+                    f"INSERT INTO {table} (cat_id, {column}, class_name, status, count, score_sum, score_count) "
+                    f"SELECT CAST(cat_id AS TEXT), {expression}, "
+                    f"COALESCE({CLASS_NAME_SQL}, ''), COALESCE(status, ''), "
+                    f"COUNT(*), COALESCE(SUM(health_score), 0), COUNT(health_score) "
+                    f"FROM health_records WHERE cat_id IS NOT NULL AND {expression} IS NOT NULL "
+                    f"GROUP BY 1, 2, 3, 4"
+                )
+                rows[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        seconds = round(time.perf_counter() - start, 2)
+        print(f" 汇总表重建完成: {rows}, {seconds}s")
+        return {"rows": rows, "seconds": seconds}
@@ -0,0 +1,238 @@
+﻿import json
+import time
+from datetime import datetime
+
+from .database import connect, get_db_path
+from .health_records import CLASS_NAME_SQL
+from .migrations import migrate
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 升级提醒 -> 给用户的说明
+ESCALATION_MESSAGES = {
+    "consecutive_danger": "短时间内连续出现高风险结果，建议尽快就医",
+    "sustained_abnormal": "连续多次结果异常，建议调整饮食并咨询兽医",
+    "elevated_risk": "近期风险分数持续偏高，请密切观察"
+}
+
+
+def parse_time(value):
+    try:
+        return datetime.strptime(str(value)[:19], TIME_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+class TrendEngine:
+    """
+    每只猫的流式趋势状态，每条新记录 O(1) 更新，不需要重新扫描历史
+    - 风险分数 (100 - health_score) 的指数加权移动平均 (EWMA)
+    - 当前类别/状态的连续次数，以及每个类别出现过的最长连续次数
+    - 最近一次正常结果的时间
+    - 升级提醒: danger_window_hours 内连续 danger_run 次 danger、连续 abnormal_run 次非正常、EWMA 超过 ewma_alert
+    HealthAnalyzer 只看单次检测，这里看的是同一只猫的结果序列
+    """
+
+    def __init__(self, alpha=0.3, danger_run=2, danger_window_hours=48, abnormal_run=3, ewma_alert=50):
+        self.alpha = alpha
+        self.danger_run = danger_run
+        self.danger_window = danger_window_hours * 3600
+        self.abnormal_run = abnormal_run
+        self.ewma_alert = ewma_alert
+
+    @staticmethod
+    def new_state():
+        return {
+            "count": 0,
+            "last_record_id": None,
+            "last_at": None,
+            "ewma_risk": None,
+            "last_risk": None,
+            "current_class": None,
+            "class_run": 0,
+            "longest_runs": {},
+            "current_status": None,
+            "status_run": 0,
+            "danger_streak": 0,
+            "last_normal_at": None,
+            "escalations": [],
+            "escalated_since": None
+        }
+
+    def update(self, state, record):
+        """用一条 health_records 记录 {id, status, health_score, class_name, created_at} 更新状态"""
+        at = record.get("created_at")
+        status = record.get("status")
+        class_name = record.get("class_name")
+        previous_at = parse_time(state["last_at"])
+        current_at = parse_time(at)
+
+        if record.get("health_score") is not None:
+            risk = 100 - float(record["health_score"])
+            state["last_risk"] = risk
+            state["ewma_risk"] = round(
+                risk if state["ewma_risk"] is None else self.alpha * risk + (1 - self.alpha) * state["ewma_risk"], 2
+            )
+
+        if class_name is not None:
+            state["class_run"] = state["class_run"] + 1 if class_name == state["current_class"] else 1
+            state["current_class"] = class_name
+            state["longest_runs"][class_name] = max(state["longest_runs"].get(class_name, 0), state["class_run"])
+
+        if status == "danger":
+            within_window = (
+                state["current_status"] == "danger" and previous_at is not None and current_at is not None
+                and (current_at - previous_at).total_seconds() <= self.danger_window
+            )
+            state["danger_streak"] = state["danger_streak"] + 1 if within_window else 1
+        else:
+            state["danger_streak"] = 0
+
+        state["status_run"] = state["status_run"] + 1 if status == state["current_status"] else 1
+        state["current_status"] = status
+        if status == "normal":
+            state["last_normal_at"] = at
+
+        state["count"] += 1
+        state["last_record_id"] = record.get("id")
+        state["last_at"] = at
+
+        escalations = []
+        if state["danger_streak"] >= self.danger_run:
+            escalations.append("consecutive_danger")
+        if status not in ("normal", None) and state["status_run"] >= self.abnormal_run:
+            escalations.append("sustained_abnormal")
+        if state["ewma_risk"] is not None and state["ewma_risk"] >= self.ewma_alert:
+            escalations.append("elevated_risk")
+        if escalations and not state["escalations"]:
+            state["escalated_since"] = at
+        elif not escalations:
+            state["escalated_since"] = None
+        state["escalations"] = escalations
+        return state
+
+    def summarize(self, state, now=None):
+        """接口返回的趋势摘要"""
+        now = now or datetime.utcnow()
+        last_normal = parse_time(state["last_normal_at"])
+        if state["escalations"]:
+            level = "escalated"
+        elif state["current_status"] not in ("normal", None):
+            level = "watch"
+        else:
+            level = "stable"
+        return {
+            "level": level,
+            "escalations": [
+                {"code": code, "message": ESCALATION_MESSAGES[code]} for code in state["escalations"]
+            ],
+            "escalated_since": state["escalated_since"],
+            "ewma_risk": state["ewma_risk"],
+            "last_risk": state["last_risk"],
+            "current_class": state["current_class"],
+            "class_run": state["class_run"],
+            "longest_runs": state["longest_runs"],
+            "current_status": state["current_status"],
+            "status_run": state["status_run"],
+            "danger_streak": state["danger_streak"],
+            "last_normal_at": state["last_normal_at"],
+            "hours_since_last_normal": round((now - last_normal).total_seconds() / 3600, 1) if last_normal else None,
+            "records": state["count"],
+            "last_record_at": state["last_at"]
+        }
+
+
+class TrendStore:
+    """
+    cat_trends 表：每只猫一行趋势状态 (JSON)
+    HealthRecordWriter 在写入 health_records 的同一事务中调用 apply() 更新状态，
+    查询趋势只读一行；rebuild() 按 id 顺序扫描一遍 health_records 重新计算全部状态
+    """
+
+    def __init__(self, db_path=None, engine=None):
+        self.db_path = db_path or get_db_path()
+        self.engine = engine or TrendEngine()
+        conn = connect(self.db_path)
+        try:
+            migrate(conn)
+        finally:
+            conn.close()
+
+    def apply(self, conn, records):
+        """在调用方的写事务中，用新写入的记录（已带 id）更新对应猫咪的状态"""
+        states = {}
+        for record in records:
+            # 没有 cat_id 的记录不属于任何一只猫（与 rebuild 的 WHERE cat_id IS NOT NULL 一致）
+            if record.get("cat_id") is None:
+                continue
+            cat_id = str(record["cat_id"])
+            if cat_id not in states:
+                row = conn.execute("SELECT state FROM cat_trends WHERE cat_id = ?", (cat_id,)).fetchone()
+                states[cat_id] = json.loads(row[0]) if row else self.engine.new_state()
+            self.engine.update(states[cat_id], record)
+        self._save(conn, states)
+
+    def get(self, cat_id, now=None):
+        """趋势摘要；这只猫还没有记录时返回 None"""
+        conn = connect(self.db_path)
+        try:
+            row = conn.execute("SELECT state FROM cat_trends WHERE cat_id = ?", (str(cat_id),)).fetchone()
+        finally:
+            conn.close()
+        return self.engine.summarize(json.loads(row["state"]), now) if row else None
+
+    def ensure_built(self):
+        """cat_trends 为空而 health_records 已有记录（刚升级、或记录由其它程序写入）时重建"""
+        conn = connect(self.db_path)
+        try:
+            empty = conn.execute("SELECT 1 FROM cat_trends LIMIT 1").fetchone() is None
+            has_records = conn.execute("SELECT 1 FROM health_records LIMIT 1").fetchone() is not None
+        finally:
+            conn.close()
+        if empty and has_records:
+            return self.rebuild()
+        return None
+
+    def rebuild(self):
+        """按 id 顺序扫描一遍 health_records 重建所有猫咪的状态；期间持有写锁，新记录等待重建完成后再写入"""
+        start = time.perf_counter()
+        states = {}
+        count = 0
+        conn = connect(self.db_path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                f"SELECT id, cat_id, status, health_score, created_at, {CLASS_NAME_SQL} AS class_name "
+                "FROM health_records WHERE cat_id IS NOT NULL ORDER BY id"
+            )
+            for row in rows:
+                cat_id = str(row["cat_id"])
+                if cat_id not in states:
+                    states[cat_id] = self.engine.new_state()
+                self.engine.update(states[cat_id], dict(row))
+                count += 1
+            conn.execute("DELETE FROM cat_trends")
+            self._save(conn, states)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        seconds = round(time.perf_counter() - start, 2)
+        print(f" 趋势状态重建完成: {len(states)} 只猫, {count} 条记录, {seconds}s")
+        return {"cats": len(states), "records": count, "seconds": seconds}
+
+    @staticmethod
+    def _save(conn, states):
+        now = datetime.utcnow().strftime(TIME_FORMAT)
+        conn.executemany(
+            "INSERT INTO cat_trends (cat_id, state, last_record_id, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(cat_id) DO UPDATE SET state = excluded.state, "
+            "last_record_id = excluded.last_record_id, updated_at = excluded.updated_at",
+            [
+                (cat_id, json.dumps(state, ensure_ascii=False), state["last_record_id"], now)
+                for cat_id, state in states.items()
+            ]
+        )
+
@@ -1 +1,8 @@
 ﻿from .detector import YOLODetector
+from .admission import AdmissionController, OverloadedError
+from .batching import BatchInferenceQueue
+from .process_pool import InferenceProcessPool
+from .result_cache import ResultCache, make_cache_key
+from .perceptual_hash import NearDuplicateIndex, dhash, mean_hsv
+from .quality_gate import ImageQualityGate, PoorImageQualityError
+from .tta import TTAEngine, weighted_boxes_fusion
@@ -0,0 +1,88 @@
+﻿import threading
+import time
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from contextlib import contextmanager
+
+
+class OverloadedError(Exception):
+    """推理队列已满，或等待超过截止时间"""
+
+
+class AdmissionController:
+    """
+    推理准入控制
+    同时等待/执行推理的请求最多 max_pending 个，再来的请求立即拒绝而不是继续排队；
+    每个请求从准入开始最多等待 deadline_ms 毫秒，超时的任务被取消
+    """
+
+    def __init__(self, max_pending=32, deadline_ms=10000):
+        self.max_pending = int(max_pending)
+        self.deadline = float(deadline_ms) / 1000.0
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {"admitted": 0, "rejected": 0, "timeouts": 0, "degraded": 0, "peak_in_flight": 0}
+
+    @contextmanager
+    def admit(self):
+        """占用一个推理名额，返回该请求的截止时间 (time.monotonic)；名额用完时抛出 OverloadedError"""
+        with self._lock:
+            if self._in_flight >= self.max_pending:
+                self._stats["rejected"] += 1
+                raise OverloadedError(f"推理队列已满 ({self.max_pending})")
+            self._in_flight += 1
+            self._stats["admitted"] += 1
+            self._stats["peak_in_flight"] = max(self._stats["peak_in_flight"], self._in_flight)
+        try:
+            yield time.monotonic() + self.deadline
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    @staticmethod
+    def remaining(deadline):
+        return max(0.0, deadline - time.monotonic())
+
+    def wait(self, future, deadline):
+        """在截止时间前等待推理结果；超时则取消任务（还在排队的不再推理）并抛出 OverloadedError"""
+        try:
+            return future.result(timeout=self.remaining(deadline))
+        except FuturesTimeoutError:
+            future.cancel()
+            self.record_timeout()
+            raise OverloadedError(f"推理等待超过 {self.deadline:g} 秒")
+
+    def record_timeout(self):
+        with self._lock:
+            self._stats["timeouts"] += 1
+
+    def record_degraded(self):
+        with self._lock:
+            self._stats["degraded"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = self._in_flight
+        stats["max_pending"] = self.max_pending
+        stats["deadline_ms"] = self.deadline * 1000.0
+        return stats
+
+    def metrics_text(self, queue_depth=0):
+        """Prometheus文本格式的指标"""
+        stats = self.stats()
+        metrics = [
+            ("cathealth_inference_in_flight", "gauge", "已准入、等待或正在推理的请求数", stats["in_flight"]),
+            ("cathealth_inference_queue_depth", "gauge", "推理队列中尚未返回结果的图像数", queue_depth),
+            ("cathealth_inference_max_pending", "gauge", "准入上限", stats["max_pending"]),
+            ("cathealth_admission_admitted_total", "counter", "准入的请求数", stats["admitted"]),
+            ("cathealth_admission_rejected_total", "counter", "因队列已满被拒绝的请求数", stats["rejected"]),
+            ("cathealth_admission_timeouts_total", "counter", "超过截止时间的请求数", stats["timeouts"]),
+            ("cathealth_admission_degraded_total", "counter", "降级为图像特征分析的请求数", stats["degraded"])
+        ]
+        lines = []
+        for name, metric_type, help_text, value in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
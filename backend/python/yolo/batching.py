@@ -0,0 +1,100 @@
+﻿import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class BatchInferenceQueue:
+    """
+    微批处理推理队列
+    多个Flask线程提交的图像在这里汇总，凑满 max_batch_size 张
+    或等待 max_wait_ms 毫秒后，统一做一次批量前向推理。
+    所有模型调用都在唯一的工作线程里执行，避免多线程争用同一个YOLO对象。
+    """
+
+    def __init__(self, detector, max_batch_size=8, max_wait_ms=20):
+        self.detector = detector
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {
+            "submitted": 0,
+            "batches": 0,
+            "images": 0,
+            "largest_batch": 0,
+            "errors": 0
+        }
+
+        self._worker = threading.Thread(target=self._run, name="yolo-batcher", daemon=True)
+        self._worker.start()
+        print(f" 批处理队列已启动: batch={self.max_batch_size}, wait={max_wait_ms}ms")
+
+    def submit(self, image, timeout=None):
+        """提交一张图像并阻塞等待它自己的检测结果"""
+        return self.submit_async(image).result(timeout=timeout)
+
+    def submit_async(self, image, timeout=None):
+        """提交一张图像，返回 Future（队列不限长度，timeout 只为与 InferenceProcessPool 接口一致）"""
+        future = Future()
+        with self._lock:
+            self._stats["submitted"] += 1
+        self._queue.put((image, future))
+        return future
+
+    def pending(self):
+        """当前排队等待推理的图像数量"""
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["pending"] = self.pending()
+        stats["max_batch_size"] = self.max_batch_size
+        stats["max_wait_ms"] = self.max_wait * 1000.0
+        stats["avg_batch_size"] = round(stats["images"] / stats["batches"], 2) if stats["batches"] else 0.0
+        return stats
+
+    def _collect_batch(self):
+        """阻塞等待第一张图像，然后在时间窗口内尽量凑满一个批次"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            # 调用方可能已经取消（例如超时），跳过这些图像
+            batch = [(image, future) for image, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            images = [image for image, _ in batch]
+            try:
+                results = self.detector.detect_stool_features_batch(images)
+            except Exception as e:
+                print(f" 批量推理失败: {e}")
+                with self._lock:
+                    self._stats["errors"] += 1
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            with self._lock:
+                self._stats["batches"] += 1
+                self._stats["images"] += len(batch)
+                self._stats["largest_batch"] = max(self._stats["largest_batch"], len(batch))
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
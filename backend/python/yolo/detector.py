@@ -1,15 +1,37 @@
-﻿import cv2
-import numpy as np
+﻿import numpy as np
+import os
+import threading
+import time
 from PIL import Image
-import io
-import base64
-from ultralytics import YOLO
+
+from .image_decode import decode_base64, decode_to_pil
+from .perceptual_hash import dhash, mean_hsv
+
+def to_numpy(values):
+    """torch张量或numpy数组统一转换为numpy数组"""
+    if hasattr(values, "cpu"):
+        return values.cpu().numpy()
+    return np.asarray(values)
 
 class YOLODetector:
-    def __init__(self, model_path):
+    def __init__(self, model_path, backend=None, lazy=False, adaptive_imgsz=None, adaptive_conf=None):
         self.model_path = model_path
+        # 推理后端: torch (ultralytics)、onnx (onnxruntime) 或 onnx-int8 (量化模型)
+        self.backend = backend or os.environ.get("YOLO_BACKEND", "torch")
         self.model = None
-        self.load_model()
+        # 推理参数 - 关键修复：使用极低的置信度阈值
+        self.predict_kwargs = {"conf": 0.001, "iou": 0.05, "imgsz": 640, "max_det": 10}
+        # 自适应分辨率: 先以 adaptive_imgsz 推理，最高置信度达到 adaptive_conf 直接采用，
+        # 否则裁剪到低分辨率检测到的区域，再以 imgsz 推理 (adaptive_imgsz=0 关闭)
+        self.adaptive_imgsz = int(adaptive_imgsz if adaptive_imgsz is not None else os.environ.get("YOLO_ADAPTIVE_IMGSZ", 0))
+        self.adaptive_conf = float(adaptive_conf if adaptive_conf is not None else os.environ.get("YOLO_ADAPTIVE_CONF", 0.5))
+        self.model_version = self._get_model_version()
+        self.load_seconds = None
+        self._load_attempted = False
+        self._load_lock = threading.Lock()
+        # lazy=True 时构造不导入ultralytics/torch，第一次 ensure_loaded() 或推理时才加载
+        if not lazy:
+            self.ensure_loaded()
         
         # 类别映射
         self.class_mapping = {
@@ -20,21 +42,111 @@ class YOLODetector:
             4: {"name": "寄生虫感染", "risk": 75, "color": "#dc3545", "advice": "建议立即就医进行专业检查"}
         }
     
+    def ensure_loaded(self):
+        """加载模型（只尝试一次，多线程并发调用时只有一个线程加载），返回模型是否可用"""
+        if not self._load_attempted:
+            with self._load_lock:
+                if not self._load_attempted:
+                    start = time.perf_counter()
+                    self.load_model()
+                    self.load_seconds = round(time.perf_counter() - start, 3)
+                    self._load_attempted = True
+        return self.model is not None
+    
     def load_model(self):
         try:
-            print(" 加载YOLO模型...")
-            self.model = YOLO(self.model_path)
+            print(f" 加载YOLO模型... (后端: {self.backend})")
+            if self.backend in ("onnx", "onnx-int8"):
+                from .onnx_backend import OnnxYOLO
+                self.model = OnnxYOLO.from_weights(
+                    self.model_path,
+                    imgsz=self.predict_kwargs["imgsz"],
+                    num_threads=os.environ.get("YOLO_NUM_THREADS") or None,
+                    quantized=self.backend == "onnx-int8"
+                )
+            else:
+                from ultralytics import YOLO
+                self.model = YOLO(self.model_path)
             print(" YOLO模型加载成功")
         except Exception as e:
             print(f" 模型加载失败: {e}")
     
+    def prepare_for_fork(self):
+        """
+        预加载(pre-fork)模式下在主进程fork之前调用，权重以写时复制方式共享给所有worker
+        - 提前融合Conv+BN，否则每个worker第一次推理时各自融合，得到私有的权重副本
+        - 主进程只用单线程计算，fork前不启动OpenMP线程池（子进程中会失效）
+        onnxruntime会话创建时就启动线程池，不能跨fork使用，onnx后端返回False，由各worker自己加载
+        """
+        if self.backend in ("onnx", "onnx-int8"):
+            return False
+        
+        try:
+            import torch
+        except ImportError:
+            return False
+        torch.set_num_threads(1)
+        if not self.ensure_loaded():
+            return False
+        self.model.fuse()
+        return True
+    
+    def _get_model_version(self):
+        """模型版本标识（权重文件名、大小、修改时间、推理后端、自适应分辨率设置），用作结果缓存键的一部分"""
+        adaptive = f":adaptive{self.adaptive_imgsz}@{self.adaptive_conf:g}" if self.adaptive_enabled else ""
+        try:
+            stat = os.stat(self.model_path)
+            return f"{os.path.basename(self.model_path)}:{stat.st_size}:{int(stat.st_mtime)}:{self.backend}{adaptive}"
+        except OSError:
+            return f"{self.model_path}:{self.backend}{adaptive}"
+    
+    @property
+    def adaptive_enabled(self):
+        return 0 < self.adaptive_imgsz < self.predict_kwargs["imgsz"]
+    
+    def warmup(self, sizes=None, batch_size=1, runs=1):
+        """
+        用灰色空白图像在每个输入尺寸上推理几次，提前完成计算图初始化、线程池启动和内存分配
+        batch_size>1 时额外按批大小推理一次；返回每个尺寸的耗时(ms)
+        """
+        if not self.ensure_loaded():
+            return {}
+        
+        sizes = list(sizes or [self.predict_kwargs["imgsz"]])
+        if self.adaptive_enabled and self.adaptive_imgsz not in sizes:
+            sizes.append(self.adaptive_imgsz)
+        
+        timings = {}
+        for size in sizes:
+            dummy = Image.new("RGB", (size, size), (114, 114, 114))
+            kwargs = dict(self.predict_kwargs, imgsz=size)
+            
+            start = time.perf_counter()
+            for _ in range(runs):
+                self.model(dummy, **kwargs)
+            if batch_size > 1:
+                self.model([dummy] * batch_size, **kwargs)
+            timings[size] = round((time.perf_counter() - start) * 1000, 1)
+            print(f" 预热完成: imgsz={size}, 耗时 {timings[size]}ms")
+        return timings
+    
     def base64_to_image(self, base64_string):
         try:
-            if base64_string.startswith('data:image'):
-                base64_string = base64_string.split(',')[1]
-            image_data = base64.b64decode(base64_string)
-            image = Image.open(io.BytesIO(image_data))
-            return image.convert('RGB')
+            return self.bytes_to_image(decode_base64(base64_string))
+        except Exception as e:
+            print(f" 图像解码失败: {e}")
+            return None
+    
+    def bytes_to_image(self, image_bytes):
+        """
+        图像文件字节转为PIL图像；JPEG按推理尺寸缩小解码，EXIF方向和透明通道在解码时处理
+        同时计算感知哈希和平均颜色，保存在 image.info["dhash"] / image.info["mean_hsv"] 中用于近似重复检测
+        """
+        try:
+            image = decode_to_pil(image_bytes, max_side=self.predict_kwargs["imgsz"])
+            image.info["dhash"] = dhash(image)
+            image.info["mean_hsv"] = mean_hsv(image)
+            return image
         except Exception as e:
             print(f" 图像解码失败: {e}")
             return None
@@ -50,18 +162,114 @@ class YOLODetector:
             print(f"⚠️ 無法保存調試圖像: {e}")
         print(" 开始检测...")
         
-        if self.model is None:
+        if not self.ensure_loaded():
             return self._get_fallback_result("模型未加载")
         
         try:
-            # 关键修复：使用极低的置信度阈值
-            results = self.model(image, conf=0.001, iou=0.05, imgsz=640, max_det=10)
-            
-            if len(results) > 0 and results[0].boxes is not None and len(results[0].boxes) > 0:
+            (result, inference), = self._predict([image])
+        except Exception as e:
+            print(f" 检测异常: {e}")
+            return self._get_fallback_result(f"检测异常: {e}")
+        
+        return self._with_inference_info(self._build_result(result, image), inference)
+    
+    def detect_stool_features_batch(self, images):
+        """一次前向推理检测多张图像，返回结果顺序与输入一致"""
+        images = list(images)
+        print(f" 开始批量检测: {len(images)} 张图像")
+        
+        if not self.ensure_loaded():
+            return [self._get_fallback_result("模型未加载") for _ in images]
+        
+        try:
+            predictions = self._predict(images)
+        except Exception as e:
+            print(f" 批量检测异常: {e}")
+            return [self._get_fallback_result(f"检测异常: {e}") for _ in images]
+        
+        return [
+            self._with_inference_info(self._build_result(result, image), inference)
+            for (result, inference), image in zip(predictions, images)
+        ]
+    
+    def _predict(self, images):
+        """
+        推理一批图像，返回 [(YOLO结果, 推理路径)]
+        推理路径 path: full_res（直接按 imgsz 推理）、low_res（低分辨率结果已足够）、
+        roi_full_res（低分辨率置信度不够，裁剪到检测区域后按 imgsz 重新推理）
+        """
+        imgsz = self.predict_kwargs["imgsz"]
+        if not self.adaptive_enabled:
+            results = self.model(images, **self.predict_kwargs)
+            return [(result, {"path": "full_res", "imgsz": imgsz}) for result in results]
+        
+        low_res = self.model(images, **dict(self.predict_kwargs, imgsz=self.adaptive_imgsz))
+        predictions = [None] * len(images)
+        retry = []
+        for index, (result, image) in enumerate(zip(low_res, images)):
+            confidence = self._top_confidence(result)
+            if confidence >= self.adaptive_conf:
+                predictions[index] = (result, {
+                    "path": "low_res", "imgsz": self.adaptive_imgsz, "low_res_confidence": round(confidence, 3)
+                })
+            else:
+                retry.append((index, confidence, self._roi(result, image)))
+        
+        if retry:
+            crops = [images[index].crop(roi) if roi else images[index] for index, _, roi in retry]
+            for (index, confidence, roi), result in zip(retry, self.model(crops, **self.predict_kwargs)):
+                predictions[index] = (result, {
+                    "path": "roi_full_res" if roi else "full_res", "imgsz": imgsz,
+                    "low_res_confidence": round(confidence, 3), "roi": list(roi) if roi else None
+                })
+        return predictions
+    
+    @staticmethod
+    def _top_confidence(result):
+        if result is None or result.boxes is None or len(result.boxes) == 0:
+            return 0.0
+        return float(np.max(to_numpy(result.boxes.conf)))
+    
+    def _roi(self, result, image, margin=0.25, min_fraction=0.3):
+        """
+        低分辨率检测到的感兴趣区域 (left, top, right, bottom)：置信度不低于最高值一半的检测框的外接矩形，
+        四周各扩展 margin 倍框尺寸，且不小于原图的 min_fraction；没有检测框或区域接近整张图时返回 None
+        """
+        top = self._top_confidence(result)
+        if top <= 0:
+            return None
+        confidences = to_numpy(result.boxes.conf)
+        boxes = to_numpy(result.boxes.xyxy)[confidences >= top * 0.5]
+        
+        width, height = image.size
+        x1, y1 = boxes[:, 0].min(), boxes[:, 1].min()
+        x2, y2 = boxes[:, 2].max(), boxes[:, 3].max()
+        box_w = max(x2 - x1, width * min_fraction)
+        box_h = max(y2 - y1, height * min_fraction)
+        center_x, center_y = (x1 + x2) / 2, (y1 + y2) / 2
+        half_w, half_h = box_w * (0.5 + margin), box_h * (0.5 + margin)
+        
+        roi = (
+            int(max(0, center_x - half_w)), int(max(0, center_y - half_h)),
+            int(min(width, center_x + half_w)), int(min(height, center_y + half_h))
+        )
+        if (roi[2] - roi[0]) * (roi[3] - roi[1]) >= 0.9 * width * height:
+            return None
+        return roi
+    
+    @staticmethod
+    def _with_inference_info(result, inference):
+        result["analysis_info"]["inference"] = inference
+        return result
+    
+    def _build_result(self, result, image):
+        """把单张图像的YOLO输出转换为接口返回格式"""
+        try:
+            if result is not None and result.boxes is not None and len(result.boxes) > 0:
                 # 有检测结果
-                boxes = results[0].boxes
-                confidences = boxes.conf.cpu().numpy()
-                class_ids = boxes.cls.cpu().numpy()
+                boxes = result.boxes
+                confidences = to_numpy(boxes.conf)
+                class_ids = to_numpy(boxes.cls)
                 
                 # 取置信度最高的
                 max_idx = np.argmax(confidences)
@@ -107,6 +315,13 @@ class YOLODetector:
             print(f" 检测异常: {e}")
             return self._get_fallback_result(f"检测异常: {e}")
     
+    def degraded_result(self, image):
+        """服务过载时的降级结果：只用颜色特征快速分类，不调用模型"""
+        result = self._analyze_by_image_features(image)
+        result["analysis_info"]["note"] = "服务繁忙，使用图像特征快速分析"
+        result["degraded"] = True
+        return result
+    
     def _analyze_by_image_features(self, image):
         """基于图像特征分析"""
         print(" 使用图像特征分析...")
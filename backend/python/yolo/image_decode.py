@@ -0,0 +1,79 @@
+﻿import base64
+import io
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# OpenCV的JPEG缩小解码标志名（libjpeg在DCT阶段直接按比例缩小）
+# cv2 只在真正解码时导入，导入本模块不会加载OpenCV
+REDUCED_COLOR_FLAGS = {
+    1: "IMREAD_COLOR",
+    2: "IMREAD_REDUCED_COLOR_2",
+    4: "IMREAD_REDUCED_COLOR_4",
+    8: "IMREAD_REDUCED_COLOR_8"
+}
+
+
+def decode_base64(base64_string):
+    """去掉 data:image/...;base64, 前缀并解码为字节"""
+    _, sep, payload = base64_string.partition(',')
+    return base64.b64decode(payload if sep else base64_string)
+
+
+def reduction_factor(size, max_side):
+    """
+    选择最大的缩小倍数(1/2/4/8)，保证长边缩小后仍不小于 max_side
+    手机12MP照片(4032x3024)在 max_side=640 时按1/4解码
+    """
+    if not max_side or not size:
+        return 1
+    longest = max(size)
+    for factor in (8, 4, 2):
+        if longest // factor >= max_side:
+            return factor
+    return 1
+
+
+def peek_size(image_bytes):
+    """只解析文件头获取 (宽, 高)，不解码像素"""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            return image.size
+    except Exception:
+        return None
+
+
+def decode_to_bgr(image_bytes, max_side=640):
+    """
+    直接解码为OpenCV的BGR数组
+    - 字节通过 np.frombuffer 交给 cv2.imdecode，不额外复制
+    - 大图按比例缩小解码，max_side=None 时保持原分辨率
+    - cv2.imdecode 会按EXIF方向旋转，并把灰度/带透明通道的图像统一为3通道BGR
+    """
+    import cv2
+
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    factor = reduction_factor(peek_size(image_bytes), max_side)
+    image = cv2.imdecode(buffer, getattr(cv2, REDUCED_COLOR_FLAGS[factor]))
+    if image is not None:
+        return image
+
+    # OpenCV不支持的格式交给PIL
+    rgb = np.asarray(decode_to_pil(image_bytes, max_side))
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+
+
+def decode_to_pil(image_bytes, max_side=640):
+    """
+    解码为RGB的PIL图像
+    JPEG使用 draft() 在解码阶段缩小，EXIF方向原地修正，RGBA/灰度/调色板统一转为RGB
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    if image.format == 'JPEG':
+        factor = reduction_factor(image.size, max_side)
+        if factor > 1:
+            image.draft('RGB', (image.width // factor, image.height // factor))
+    ImageOps.exif_transpose(image, in_place=True)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
@@ -0,0 +1,61 @@
+﻿import os
+import threading
+import time
+
+
+class LazyModel:
+    """
+    延迟加载的ultralytics模型
+    导入ultralytics/torch和加载权重要好几秒，这里推迟到第一次推理时才做，
+    进程启动和 /health 不再等待模型；调用方式与 ultralytics.YOLO 相同
+    """
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.error = None
+        self.load_seconds = None
+
+        self._model = None
+        self._attempted = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        """模型是否已加载（不会触发加载）"""
+        return self._model is not None
+
+    def get(self):
+        """返回已加载的模型，首次调用时加载；加载失败返回 None，且不再重试"""
+        if self._attempted:
+            return self._model
+
+        with self._lock:
+            if self._attempted:
+                return self._model
+
+            start = time.perf_counter()
+            try:
+                if not os.path.exists(self.model_path):
+                    raise FileNotFoundError(f"模型文件不存在: {self.model_path}")
+                print(" 加载YOLO模型...")
+                from ultralytics import YOLO
+                self._model = YOLO(self.model_path)
+                self.load_seconds = round(time.perf_counter() - start, 3)
+                print(f" YOLO模型加载成功 ({self.load_seconds}s)")
+                print(f" 模型类别: {self._model.names}")
+            except ImportError as e:
+                self.error = f"无法导入ultralytics: {e}"
+                print(f" {self.error}")
+                print(" 请安装: pip install ultralytics")
+            except Exception as e:
+                self.error = f"模型加载失败: {e}"
+                print(f" {self.error}")
+            self._attempted = True
+            return self._model
+
+    @property
+    def names(self):
+        return self.get().names
+
+    def __call__(self, *args, **kwargs):
+        return self.get()(*args, **kwargs)
@@ -0,0 +1,231 @@
+﻿import ast
+import os
+
+import cv2
+import numpy as np
+
+
+class OnnxBoxes:
+    """与ultralytics Boxes接口相近的检测框容器（numpy数组）"""
+
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+
+    def __len__(self):
+        return len(self.conf)
+
+
+class OnnxResult:
+    """单张图像的推理结果"""
+
+    def __init__(self, boxes, orig_shape, names):
+        self.boxes = boxes
+        self.orig_shape = orig_shape
+        self.names = names
+        self.probs = None
+
+
+class OnnxYOLO:
+    """
+    基于onnxruntime的YOLOv8 CPU推理后端
+    调用方式与 ultralytics.YOLO 相同: model(images, conf=..., iou=..., imgsz=..., max_det=...)
+    预处理(letterbox)和后处理(NMS)都用NumPy实现，推理时不需要PyTorch。
+    """
+
+    def __init__(self, onnx_path, names=None, num_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = int(num_threads)
+
+        self.onnx_path = onnx_path
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.input_shape = self.session.get_inputs()[0].shape
+        self.names = names or self._read_names()
+
+    @classmethod
+    def from_weights(cls, weights_path, imgsz=640, num_threads=None, quantized=False):
+        """
+        从best.pt加载，第一次使用时导出ONNX并缓存在权重文件旁边
+        quantized=True 时加载 python -m yolo.quantize 生成的INT8模型
+        """
+        if quantized:
+            int8_path = quantized_model_path(weights_path)
+            if not os.path.exists(int8_path):
+                print(f" INT8模型不存在: {int8_path}，请先运行 python -m yolo.quantize，暂时使用FP32模型")
+            elif is_stale(int8_path, weights_path):
+                # 与 export_onnx 相同的检查：权重更新后旧的量化模型不再可用
+                print(f" 警告: INT8模型比权重文件旧: {int8_path}，请重新运行 python -m yolo.quantize，暂时使用FP32模型")
+            else:
+                print(f" 使用INT8量化模型: {int8_path}")
+                return cls(int8_path, num_threads=num_threads)
+
+        onnx_path = export_onnx(weights_path, imgsz=imgsz)
+        return cls(onnx_path, num_threads=num_threads)
+
+    def _read_names(self):
+        """从导出时写入的模型元数据中读取类别名"""
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        if "names" in metadata:
+            return {int(k): v for k, v in ast.literal_eval(metadata["names"]).items()}
+        return {}
+
+    def _static_size(self, imgsz):
+        """静态导出的模型只能使用导出时的输入尺寸"""
+        height, width = self.input_shape[2], self.input_shape[3]
+        if isinstance(height, int) and isinstance(width, int):
+            return height, width
+        return imgsz, imgsz
+
+    def __call__(self, source, conf=0.25, iou=0.7, imgsz=640, max_det=300, **kwargs):
+        images = source if isinstance(source, (list, tuple)) else [source]
+        size = self._static_size(imgsz)
+
+        batch = []
+        metas = []
+        for image in images:
+            rgb = to_rgb_array(image)
+            tensor, ratio, pad = letterbox(rgb, size)
+            batch.append(tensor)
+            metas.append((rgb.shape[:2], ratio, pad))
+
+        if self.input_shape[0] == 1:
+            # 静态batch=1的模型逐张推理
+            outputs = [self.session.run(None, {self.input_name: tensor[None]})[0][0] for tensor in batch]
+        else:
+            outputs = self.session.run(None, {self.input_name: np.stack(batch)})[0]
+
+        results = []
+        for prediction, (orig_shape, ratio, pad) in zip(outputs, metas):
+            xyxy, scores, class_ids = non_max_suppression(prediction, conf, iou, max_det)
+            xyxy = scale_boxes(xyxy, ratio, pad, orig_shape)
+            results.append(OnnxResult(OnnxBoxes(xyxy, scores, class_ids), orig_shape, self.names))
+        return results
+
+
+def is_stale(derived_path, weights_path):
+    """由权重导出/量化得到的模型文件是否比权重文件旧（权重文件不存在时按不旧处理）"""
+    return os.path.exists(weights_path) and os.path.getmtime(derived_path) < os.path.getmtime(weights_path)
+
+
+def export_onnx(weights_path, imgsz=640):
+    """导出ONNX模型；已存在且比权重新的导出文件直接复用"""
+    onnx_path = os.path.splitext(weights_path)[0] + ".onnx"
+    if os.path.exists(onnx_path) and not is_stale(onnx_path, weights_path):
+        print(f" 使用已缓存的ONNX模型: {onnx_path}")
+        return onnx_path
+
+    print(f" 导出ONNX模型: {weights_path} -> {onnx_path}")
+    from ultralytics import YOLO
+
+    exported = YOLO(weights_path).export(format="onnx", imgsz=imgsz, dynamic=True)
+    if exported and os.path.abspath(exported) != os.path.abspath(onnx_path):
+        os.replace(exported, onnx_path)
+    print(" ONNX导出完成")
+    return onnx_path
+
+
+def quantized_model_path(weights_path):
+    """INT8模型与权重文件放在同一目录: best.pt -> best.int8.onnx"""
+    return os.path.splitext(weights_path)[0] + ".int8.onnx"
+
+
+def to_rgb_array(image):
+    """PIL图像按RGB处理，numpy数组按OpenCV的BGR处理（与ultralytics一致）"""
+    if isinstance(image, np.ndarray):
+        if image.ndim == 2:
+            return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        if image.shape[2] == 4:
+            return cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return np.asarray(image.convert("RGB"))
+
+
+def letterbox(image, size, color=114):
+    """等比缩放并填充到固定尺寸，返回CHW float32张量、缩放比例和填充量"""
+    height, width = image.shape[:2]
+    new_h, new_w = size
+    ratio = min(new_h / height, new_w / width)
+
+    resized_w, resized_h = int(round(width * ratio)), int(round(height * ratio))
+    pad_w, pad_h = (new_w - resized_w) / 2, (new_h - resized_h) / 2
+
+    if (width, height) != (resized_w, resized_h):
+        image = cv2.resize(image, (resized_w, resized_h), interpolation=cv2.INTER_LINEAR)
+
+    top, bottom = int(round(pad_h - 0.1)), int(round(pad_h + 0.1))
+    left, right = int(round(pad_w - 0.1)), int(round(pad_w + 0.1))
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(color, color, color))
+
+    tensor = image.transpose(2, 0, 1).astype(np.float32) / 255.0
+    return np.ascontiguousarray(tensor), ratio, (left, top)
+
+
+def non_max_suppression(prediction, conf_thres, iou_thres, max_det, max_wh=7680):
+    """
+    YOLOv8输出(4+nc, N)的NMS，按类别分别抑制
+    返回 xyxy(K,4), 置信度(K,), 类别id(K,)
+    """
+    prediction = prediction.T
+    class_scores = prediction[:, 4:]
+    class_ids = class_scores.argmax(axis=1)
+    scores = class_scores[np.arange(len(class_scores)), class_ids]
+
+    keep = scores > conf_thres
+    boxes = xywh_to_xyxy(prediction[keep, :4])
+    scores = scores[keep]
+    class_ids = class_ids[keep]
+
+    if len(scores) == 0:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)
+
+    # 按类别偏移框坐标，一次NMS完成分类别抑制
+    offset_boxes = boxes + class_ids[:, None] * max_wh
+    indices = _nms(offset_boxes, scores, iou_thres)[:max_det]
+
+    return boxes[indices], scores[indices].astype(np.float32), class_ids[indices].astype(np.float32)
+
+
+def _nms(boxes, scores, iou_thres):
+    order = scores.argsort()[::-1]
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+
+        xx1 = np.maximum(boxes[i, 0], boxes[rest, 0])
+        yy1 = np.maximum(boxes[i, 1], boxes[rest, 1])
+        xx2 = np.minimum(boxes[i, 2], boxes[rest, 2])
+        yy2 = np.minimum(boxes[i, 3], boxes[rest, 3])
+
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_thres]
+
+    return np.array(keep, dtype=np.int64)
+
+
+def xywh_to_xyxy(boxes):
+    xyxy = np.empty_like(boxes)
+    xyxy[:, 0] = boxes[:, 0] - boxes[:, 2] / 2
+    xyxy[:, 1] = boxes[:, 1] - boxes[:, 3] / 2
+    xyxy[:, 2] = boxes[:, 0] + boxes[:, 2] / 2
+    xyxy[:, 3] = boxes[:, 1] + boxes[:, 3] / 2
+    return xyxy
+
+
+def scale_boxes(boxes, ratio, pad, orig_shape):
+    """把letterbox坐标映射回原图坐标"""
+    boxes = boxes.copy()
+    boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad[0]) / ratio
+    boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad[1]) / ratio
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, orig_shape[1])
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, orig_shape[0])
+    return boxes
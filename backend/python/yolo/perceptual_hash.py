@@ -0,0 +1,143 @@
+﻿import copy
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from PIL import Image
+
+
+def dhash(image, hash_size=8):
+    """
+    差值哈希 (dHash)，返回 hash_size*hash_size 位的整数
+    先缩小到 (hash_size+1) x hash_size 再转灰度，只处理很小的副本
+    支持PIL图像(RGB)和OpenCV数组(BGR)
+    """
+    size = (hash_size + 1, hash_size)
+    if isinstance(image, np.ndarray):
+        import cv2
+
+        small = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        pixels = small.astype(np.int16)
+    else:
+        small = image.resize(size, Image.BILINEAR, reducing_gap=2.0).convert('L')
+        pixels = np.asarray(small, dtype=np.int16)
+
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def mean_hsv(image, size=16):
+    """
+    图像平均颜色 (H, S, V)，各分量为 0-255；色相按角度取平均
+    dHash 只看灰度梯度，构图相同而颜色不同（如出现血色）的图像哈希距离可能为 0，用它补充颜色检查
+    """
+    if isinstance(image, np.ndarray):
+        import cv2
+
+        small = cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA)
+        if small.ndim == 2:
+            small = cv2.cvtColor(small, cv2.COLOR_GRAY2BGR)
+        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV).reshape(-1, 3).astype(np.float64)
+        # OpenCV 的 H 范围是 0-179
+        hsv[:, 0] *= 256.0 / 180.0
+    else:
+        small = image.resize((size, size), Image.BILINEAR, reducing_gap=2.0).convert('HSV')
+        hsv = np.asarray(small, dtype=np.float64).reshape(-1, 3)
+
+    angles = hsv[:, 0] * (2 * np.pi / 256.0)
+    # 按饱和度加权，灰色像素的色相没有意义
+    weights = hsv[:, 1] + 1e-6
+    hue = np.arctan2((np.sin(angles) * weights).sum(), (np.cos(angles) * weights).sum())
+    hue = (hue % (2 * np.pi)) * 256.0 / (2 * np.pi)
+    return (round(float(hue), 1), round(float(hsv[:, 1].mean()), 1), round(float(hsv[:, 2].mean()), 1))
+
+
+def color_distance(a, b):
+    """两个 mean_hsv 之间各分量差值的最大值，色相按环形计算"""
+    hue = abs(a[0] - b[0]) % 256
+    return max(min(hue, 256 - hue), abs(a[1] - b[1]), abs(a[2] - b[2]))
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class NearDuplicateIndex:
+    """
+    按猫咪分组的近期图像哈希索引
+    同一只猫在 window_seconds 内上传的图像，若哈希距离不超过 max_distance，
+    且平均颜色 (mean_hsv) 相差不超过 max_color_distance，直接复用之前的检测结果
+    记录全部过期的猫咪会被移除，内存占用只与时间窗口内活跃的猫咪数量有关
+    """
+
+    def __init__(self, max_distance=4, window_seconds=120, max_per_cat=32, max_color_distance=12):
+        self.max_distance = int(max_distance)
+        self.window_seconds = float(window_seconds)
+        self.max_per_cat = int(max_per_cat)
+        self.max_color_distance = float(max_color_distance)
+
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._last_prune = time.time()
+        self._stats = {"lookups": 0, "hits": 0, "color_rejects": 0}
+
+    def find(self, cat_id, image_hash, color=None):
+        """返回最接近的近期结果副本及其哈希距离，没有则返回 (None, None)"""
+        now = time.time()
+        with self._lock:
+            self._stats["lookups"] += 1
+            entries = self._expire(cat_id, now)
+            if not entries:
+                return None, None
+
+            best = None
+            for _, entry_hash, entry_color, result in entries:
+                distance = hamming_distance(image_hash, entry_hash)
+                if distance > self.max_distance or (best is not None and distance >= best[0]):
+                    continue
+                # 构图相同但颜色明显变化时不能复用结果
+                if color is not None and entry_color is not None \
+                        and color_distance(color, entry_color) > self.max_color_distance:
+                    self._stats["color_rejects"] += 1
+                    continue
+                best = (distance, result)
+
+            if best is None:
+                return None, None
+            self._stats["hits"] += 1
+            return copy.deepcopy(best[1]), best[0]
+
+    def add(self, cat_id, image_hash, result, color=None):
+        now = time.time()
+        with self._lock:
+            # 每个时间窗口清理一次所有猫咪的过期记录
+            if now - self._last_prune > self.window_seconds:
+                for expired_cat in list(self._entries):
+                    self._expire(expired_cat, now)
+                self._last_prune = now
+            entries = self._entries.setdefault(cat_id, deque(maxlen=self.max_per_cat))
+            entries.append((now, image_hash, color, copy.deepcopy(result)))
+
+    def _expire(self, cat_id, now):
+        """丢弃时间窗口之外的旧记录，全部过期时移除该猫咪；调用方持有 self._lock"""
+        entries = self._entries.get(cat_id)
+        while entries and now - entries[0][0] > self.window_seconds:
+            entries.popleft()
+        if entries is not None and not entries:
+            del self._entries[cat_id]
+            return None
+        return entries
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cats"] = len(self._entries)
+            stats["entries"] = sum(len(entries) for entries in self._entries.values())
+        stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else 0.0
+        stats["max_distance"] = self.max_distance
+        stats["window_seconds"] = self.window_seconds
+        stats["max_color_distance"] = self.max_color_distance
+        return stats
@@ -0,0 +1,391 @@
+﻿import atexit
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+# 推理进程启动阶段（就绪前）崩溃后的重启等待：从 RESPAWN_BASE_DELAY 秒开始每次翻倍，最长 RESPAWN_MAX_DELAY 秒
+RESPAWN_BASE_DELAY = 0.5
+RESPAWN_MAX_DELAY = 30.0
+
+
+def _read_slot(shm, shape):
+    """从共享内存槽位读出图像；RGB的 fromarray 会复制一份，返回的图像不再引用共享内存"""
+    array = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    return Image.fromarray(array)
+
+
+def _worker_main(worker_id, model_path, backend, num_threads, slot_names, warmup_sizes,
+                 max_batch_size, task_queue, result_queue):
+    """推理进程：加载一次模型，从任务队列读取 (任务ID, 槽位, 形状)，批量推理后回传结果字典"""
+    if num_threads:
+        for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "YOLO_NUM_THREADS"):
+            os.environ[name] = str(num_threads)
+
+    from .detector import YOLODetector
+
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    detector = YOLODetector(model_path, backend=backend)
+    ok = detector.model is not None
+    timings = detector.warmup(warmup_sizes) if ok else {}
+    result_queue.put(("ready", worker_id, ok, timings))
+
+    running = True
+    try:
+        while running:
+            task = task_queue.get()
+            if task is None:
+                break
+            batch = [task]
+            # 队列里已有的任务一起推理
+            while len(batch) < max_batch_size:
+                try:
+                    task = task_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if task is None:
+                    running = False
+                    break
+                batch.append(task)
+
+            images = [_read_slot(slots[slot], shape) for _, slot, shape in batch]
+            try:
+                results = detector.detect_stool_features_batch(images)
+                for (task_id, _, _), result in zip(batch, results):
+                    result_queue.put(("result", worker_id, task_id, result, None))
+            except Exception as e:
+                for task_id, _, _ in batch:
+                    result_queue.put(("result", worker_id, task_id, None, str(e)))
+    finally:
+        for shm in slots:
+            shm.close()
+
+
+class _Worker:
+    def __init__(self, worker_id, process, task_queue):
+        self.worker_id = worker_id
+        self.process = process
+        self.task_queue = task_queue
+        self.inflight = set()
+        self.completed = 0
+        self.ready = False
+        self.retiring = False
+
+
+class InferenceProcessPool:
+    """
+    独立的推理进程池
+    请求线程把解码后的图像写进共享内存槽位，只把 (任务ID, 槽位号, 形状) 发给推理进程，
+    推理进程返回很小的结果字典；不需要pickle整张图像。
+    - 推理进程崩溃时，它手上的任务立即失败，进程自动重启，Web进程不受影响
+    - max_tasks_per_worker>0 时每个进程处理这么多张图像后平滑重启（回收内存泄漏）
+    - restart_workers() 逐个平滑重启所有推理进程（例如更换模型文件后）
+    - 推理进程在就绪前反复崩溃（导入失败、模型文件损坏等）时按指数退避重启，
+      连续 max_startup_failures 次后停止重启，避免无限循环拉起进程
+    提供与 BatchInferenceQueue 相同的 submit/submit_async/pending/stats 接口
+    """
+
+    def __init__(self, model_path, backend=None, num_workers=2, max_side=640, slots_per_worker=4,
+                 max_batch_size=8, max_tasks_per_worker=0, num_threads=None, warmup_sizes=None,
+                 max_startup_failures=5):
+        self.model_path = model_path
+        self.backend = backend
+        self.num_workers = max(1, int(num_workers))
+        self.max_side = int(max_side)
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_tasks_per_worker = int(max_tasks_per_worker)
+        self.num_threads = num_threads or max(1, (os.cpu_count() or 1) // self.num_workers)
+        self.warmup_sizes = warmup_sizes
+        self.warmup_timings = {}
+        self.max_startup_failures = int(max_startup_failures)
+
+        # 每个槽位能放下一张长边为 max_side 的RGB图像
+        slot_size = self.max_side * self.max_side * 3
+        self._slots = [
+            shared_memory.SharedMemory(create=True, size=slot_size)
+            for _ in range(self.num_workers * max(1, int(slots_per_worker)))
+        ]
+        self._free_slots = queue.Queue()
+        for index in range(len(self._slots)):
+            self._free_slots.put(index)
+
+        self._context = multiprocessing.get_context("spawn")
+        self._result_queue = self._context.Queue()
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._worker_ids = itertools.count()
+        self._workers = {}
+        self._retired = []
+        self._tasks = {}
+        self._ready = threading.Event()
+        self._initial_pending = self.num_workers
+        self._available = False
+        self._closed = False
+        # 连续在就绪前崩溃的次数（有进程就绪后清零）、等待重启的时间点 (time.monotonic)
+        self._startup_failures = 0
+        self._respawn_at = []
+        self._crash_loop = False
+        self._stats = {"submitted": 0, "completed": 0, "errors": 0, "crashes": 0, "restarts": 0}
+
+        with self._lock:
+            for _ in range(self.num_workers):
+                self._spawn_worker()
+
+        threading.Thread(target=self._collect_results, name="inference-results", daemon=True).start()
+        threading.Thread(target=self._monitor_workers, name="inference-monitor", daemon=True).start()
+        atexit.register(self.close)
+        print(f" 推理进程池已启动: {self.num_workers} 个进程, 每个 {self.num_threads} 线程, "
+              f"{len(self._slots)} 个共享内存槽位")
+
+    def wait_ready(self, timeout=None):
+        """等待初始推理进程全部加载完模型，返回是否有进程加载成功"""
+        self._ready.wait(timeout)
+        return self._available
+
+    def submit(self, image, timeout=None):
+        """提交一张图像并阻塞等待检测结果"""
+        return self.submit_async(image, timeout=timeout).result(timeout=timeout)
+
+    def submit_async(self, image, timeout=None):
+        """提交一张图像，返回 Future；所有槽位都被占用时最多等待 timeout 秒"""
+        image = self._fit(image)
+        array = np.asarray(image, dtype=np.uint8)
+        try:
+            slot = self._free_slots.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("推理进程繁忙，没有空闲的共享内存槽位")
+
+        np.ndarray(array.shape, dtype=np.uint8, buffer=self._slots[slot].buf)[...] = array
+
+        future = Future()
+        with self._lock:
+            worker = self._pick_worker()
+            if worker is None:
+                self._free_slots.put(slot)
+                raise RuntimeError("没有可用的推理进程")
+            task_id = next(self._task_ids)
+            self._tasks[task_id] = (future, slot, worker.worker_id)
+            worker.inflight.add(task_id)
+            self._stats["submitted"] += 1
+            worker.task_queue.put((task_id, slot, array.shape))
+        return future
+
+    def pending(self):
+        """已提交、尚未返回结果的图像数量"""
+        with self._lock:
+            return len(self._tasks)
+
+    def restart_workers(self):
+        """平滑重启所有推理进程：不再分配新任务，手上的任务完成后退出并由新进程替换"""
+        with self._lock:
+            for worker in list(self._workers.values()):
+                worker.retiring = True
+                if not worker.inflight:
+                    self._retire(worker)
+            return len(self._workers)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._tasks)
+            stats["workers"] = [
+                {
+                    "pid": worker.process.pid,
+                    "ready": worker.ready,
+                    "inflight": len(worker.inflight),
+                    "completed": worker.completed,
+                    "retiring": worker.retiring
+                }
+                for worker in self._workers.values()
+            ]
+        stats["free_slots"] = self._free_slots.qsize()
+        stats["slots"] = len(self._slots)
+        stats["max_batch_size"] = self.max_batch_size
+        stats["max_tasks_per_worker"] = self.max_tasks_per_worker
+        stats["startup_failures"] = self._startup_failures
+        stats["crash_loop"] = self._crash_loop
+        return stats
+
+    def close(self):
+        """停止所有推理进程并释放共享内存"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers = list(self._workers.values()) + self._retired
+            self._workers = {}
+        for worker in workers:
+            try:
+                worker.task_queue.put(None)
+            except (OSError, ValueError):
+                pass
+        for worker in workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        for shm in self._slots:
+            shm.close()
+            shm.unlink()
+
+    def _fit(self, image):
+        """缩小到长边不超过 max_side（YOLO推理时也会缩放到这个尺寸），并统一为RGB"""
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        if max(image.size) > self.max_side:
+            image = image.copy()
+            image.thumbnail((self.max_side, self.max_side), Image.BILINEAR, reducing_gap=2.0)
+        return image
+
+    def _spawn_worker(self):
+        """启动一个推理进程（调用方持有 self._lock）"""
+        worker_id = next(self._worker_ids)
+        task_queue = self._context.Queue()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(
+                worker_id, self.model_path, self.backend, self.num_threads,
+                [shm.name for shm in self._slots], self.warmup_sizes,
+                self.max_batch_size, task_queue, self._result_queue
+            ),
+            name=f"yolo-inference-{worker_id}",
+            daemon=True
+        )
+        process.start()
+        self._workers[worker_id] = _Worker(worker_id, process, task_queue)
+
+    def _pick_worker(self):
+        """优先选择已就绪、手上任务最少的进程（调用方持有 self._lock）"""
+        candidates = [worker for worker in self._workers.values() if not worker.retiring]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda worker: (not worker.ready, len(worker.inflight)))
+
+    def _retire(self, worker):
+        """让进程处理完队列后退出，并启动替换进程（调用方持有 self._lock）"""
+        del self._workers[worker.worker_id]
+        worker.task_queue.put(None)
+        self._retired.append(worker)
+        self._stats["restarts"] += 1
+        if not self._closed:
+            self._spawn_worker()
+
+    def _finish_task(self, task_id):
+        """结束一个任务并释放槽位（调用方持有 self._lock），返回任务的 Future"""
+        task = self._tasks.pop(task_id, None)
+        if task is None:
+            return None
+        future, slot, worker_id = task
+        self._free_slots.put(slot)
+        worker = self._workers.get(worker_id)
+        if worker is not None:
+            worker.inflight.discard(task_id)
+        return future
+
+    def _schedule_respawn(self, worker):
+        """安排替换崩溃的进程（调用方持有 self._lock）；就绪后才崩溃的立即重启"""
+        if self._closed:
+            return
+        delay = 0.0
+        if not worker.ready:
+            self._startup_failures += 1
+            if self._startup_failures >= self.max_startup_failures:
+                if not self._crash_loop:
+                    print(f" 推理进程连续 {self._startup_failures} 次启动失败，停止重启")
+                self._crash_loop = True
+                return
+            delay = min(RESPAWN_MAX_DELAY, RESPAWN_BASE_DELAY * 2 ** (self._startup_failures - 1))
+        print(f" {delay:.1f}s 后重启推理进程")
+        self._respawn_at.append(time.monotonic() + delay)
+
+    def _collect_results(self):
+        while True:
+            try:
+                message = self._result_queue.get()
+            except (EOFError, OSError):
+                return
+
+            if message[0] == "ready":
+                _, worker_id, ok, timings = message
+                with self._lock:
+                    worker = self._workers.get(worker_id)
+                    if worker is not None:
+                        worker.ready = True
+                    self._startup_failures = 0
+                    self._available = self._available or ok
+                    if timings:
+                        self.warmup_timings = timings
+                    if self._initial_pending > 0:
+                        self._initial_pending -= 1
+                        if self._initial_pending == 0:
+                            self._ready.set()
+                print(f" 推理进程 {worker_id} 就绪: 模型{'已加载' if ok else '加载失败'}")
+                continue
+
+            _, worker_id, task_id, result, error = message
+            with self._lock:
+                future = self._finish_task(task_id)
+                worker = self._workers.get(worker_id)
+                if worker is not None:
+                    worker.completed += 1
+                    if self.max_tasks_per_worker > 0 and worker.completed >= self.max_tasks_per_worker:
+                        worker.retiring = True
+                    if worker.retiring and not worker.inflight:
+                        self._retire(worker)
+                if future is not None:
+                    self._stats["completed" if error is None else "errors"] += 1
+
+            if future is None:
+                continue
+            try:
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(RuntimeError(error))
+            except InvalidStateError:
+                # 调用方已超时并取消
+                pass
+
+    def _monitor_workers(self):
+        """发现异常退出的推理进程：让它手上的任务失败并重启进程（启动阶段崩溃时按指数退避）"""
+        while not self._closed:
+            time.sleep(0.5)
+            failed = []
+            with self._lock:
+                for worker in list(self._workers.values()):
+                    if worker.process.is_alive():
+                        continue
+                    print(f" 推理进程 {worker.worker_id} 异常退出 (返回码 {worker.process.exitcode})")
+                    self._stats["crashes"] += 1
+                    self._stats["errors"] += len(worker.inflight)
+                    for task_id in list(worker.inflight):
+                        failed.append(self._finish_task(task_id))
+                    del self._workers[worker.worker_id]
+                    if self._initial_pending > 0 and not worker.ready:
+                        self._initial_pending -= 1
+                        if self._initial_pending == 0:
+                            self._ready.set()
+                    self._schedule_respawn(worker)
+
+                now = time.monotonic()
+                due = [at for at in self._respawn_at if at <= now]
+                self._respawn_at = [at for at in self._respawn_at if at > now]
+                for _ in due:
+                    if not self._closed:
+                        self._spawn_worker()
+
+                self._retired = [worker for worker in self._retired if worker.process.is_alive()]
+
+            for future in failed:
+                if future is None:
+                    continue
+                try:
+                    future.set_exception(RuntimeError("推理进程异常退出"))
+                except InvalidStateError:
+                    pass
@@ -0,0 +1,111 @@
+﻿import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+
+class PoorImageQualityError(Exception):
+    """图像质量不合格（模糊、过暗/过曝、没有拍到排泄物），需要重新拍摄"""
+
+    def __init__(self, code, message, metrics):
+        super().__init__(message)
+        self.code = code
+        self.metrics = metrics
+
+    def to_dict(self):
+        return {"code": self.code, "message": str(self), "metrics": self.metrics}
+
+
+# 不合格原因 -> 给用户的重拍提示
+RETAKE_MESSAGES = {
+    "too_dark": "照片太暗，请在光线充足的地方重新拍摄",
+    "overexposed": "照片过曝，请避开强光直射后重新拍摄",
+    "blurry": "照片模糊，请保持手机稳定、对焦后重新拍摄",
+    "no_subject": "没有识别到排泄物，请对准猫砂盆中的排泄物重新拍摄"
+}
+
+
+class ImageQualityGate:
+    """
+    YOLO推理前的快速图像质量检查（缩小到 analysis_side 后计算，单张几毫秒）
+    - 曝光: 亮度直方图的第95百分位太低为过暗，第5百分位太高或大面积过曝为过曝
+    - 清晰度: 灰度图拉普拉斯算子响应的方差，低于 min_sharpness 为模糊
+    - 颜色先验: 棕/黄/绿等暖色调像素占比低于 min_subject_ratio 时认为没有拍到排泄物
+    不合格时抛出 PoorImageQualityError，不再进行YOLO推理
+    """
+
+    def __init__(self, min_sharpness=15.0, dark_level=50, bright_level=230, max_clipped_ratio=0.6,
+                 min_subject_ratio=0.01, analysis_side=256):
+        self.min_sharpness = float(min_sharpness)
+        self.dark_level = dark_level
+        self.bright_level = bright_level
+        self.max_clipped_ratio = max_clipped_ratio
+        self.min_subject_ratio = min_subject_ratio
+        self.analysis_side = int(analysis_side)
+
+        self._lock = threading.Lock()
+        self._stats = {"passed": 0, "rejected": 0, **{code: 0 for code in RETAKE_MESSAGES}}
+
+    def assess(self, image):
+        """计算质量指标，不做判断"""
+        start = time.perf_counter()
+        small = image if image.mode == "RGB" else image.convert("RGB")
+        if max(small.size) > self.analysis_side:
+            small = small.copy()
+            small.thumbnail((self.analysis_side, self.analysis_side), Image.BILINEAR, reducing_gap=2.0)
+
+        gray = np.asarray(small.convert("L"), dtype=np.float32)
+        p5, p95 = np.percentile(gray, (5, 95))
+
+        # 4邻域拉普拉斯算子
+        laplacian = (gray[1:-1, :-2] + gray[1:-1, 2:] + gray[:-2, 1:-1] + gray[2:, 1:-1]
+                     - 4 * gray[1:-1, 1:-1])
+
+        # PIL的HSV三个通道都是0-255；色相0-50约为红棕到黄绿，245以上为偏红的棕色
+        hsv = np.asarray(small.convert("HSV"))
+        hue, saturation, value = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+        subject = (((hue <= 50) | (hue >= 245)) & (saturation >= 40) & (value >= 25) & (value <= 220))
+
+        return {
+            "sharpness": round(float(laplacian.var()), 1) if laplacian.size else 0.0,
+            "brightness": round(float(gray.mean()), 1),
+            "brightness_p5": float(p5),
+            "brightness_p95": float(p95),
+            "clipped_ratio": round(float(np.mean(gray >= 250)), 3),
+            "subject_ratio": round(float(subject.mean()), 3),
+            "ms": round((time.perf_counter() - start) * 1000, 2)
+        }
+
+    def check(self, image):
+        """检查通过返回质量指标，不合格抛出 PoorImageQualityError"""
+        metrics = self.assess(image)
+        code = self._classify(metrics)
+        with self._lock:
+            if code is None:
+                self._stats["passed"] += 1
+            else:
+                self._stats["rejected"] += 1
+                self._stats[code] += 1
+        if code is not None:
+            raise PoorImageQualityError(code, RETAKE_MESSAGES[code], metrics)
+        return metrics
+
+    def _classify(self, metrics):
+        # 先看曝光：过暗/过曝的图像拉普拉斯响应也低，应提示光线问题而不是模糊
+        if metrics["brightness_p95"] < self.dark_level:
+            return "too_dark"
+        if metrics["brightness_p5"] > self.bright_level or metrics["clipped_ratio"] > self.max_clipped_ratio:
+            return "overexposed"
+        if metrics["sharpness"] < self.min_sharpness:
+            return "blurry"
+        if metrics["subject_ratio"] < self.min_subject_ratio:
+            return "no_subject"
+        return None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["min_sharpness"] = self.min_sharpness
+        stats["min_subject_ratio"] = self.min_subject_ratio
+        return stats
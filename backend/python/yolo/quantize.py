@@ -0,0 +1,252 @@
+﻿"""
+INT8 静态量化工具
+
+用法:
+    cd backend/python
+    python -m yolo.quantize --images ./calibration_images
+    python -m yolo.quantize --images ./calibration_images --weights models/best.pt --limit 200
+
+流程: best.pt -> best.onnx (FP32) -> 用样本图像做静态校准 -> best.int8.onnx
+并输出 FP32 与 INT8 的对比报告（每个类别的一致率、置信度漂移、推理延迟）。
+设置环境变量 YOLO_BACKEND=onnx-int8 后 YOLODetector 会加载量化模型。
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from .onnx_backend import OnnxYOLO, export_onnx, letterbox, quantized_model_path, to_rgb_array
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_WEIGHTS = os.path.join(PYTHON_DIR, "models", "best.pt")
+DEFAULT_CONFIG = os.path.join(PYTHON_DIR, "..", "..", "yolo_config.yaml")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def list_images(folder, limit=None):
+    paths = []
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    paths.sort()
+    return paths[:limit] if limit else paths
+
+
+def load_class_names(config_path):
+    """读取 yolo_config.yaml 中的类别名"""
+    import yaml
+
+    with open(config_path, encoding="utf-8-sig") as f:
+        config = yaml.safe_load(f)
+    return list(config["names"])
+
+
+def make_calibration_reader(paths, input_name, imgsz):
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class ImageFolderCalibrationReader(CalibrationDataReader):
+        """逐张读取校准图像，预处理与推理时完全一致"""
+
+        def __init__(self):
+            self._paths = iter(paths)
+
+        def get_next(self):
+            for path in self._paths:
+                image = cv2.imread(path)
+                if image is None:
+                    print(f" 跳过无法读取的图像: {path}")
+                    continue
+                tensor, _, _ = letterbox(to_rgb_array(image), (imgsz, imgsz))
+                return {input_name: tensor[None]}
+            return None
+
+    return ImageFolderCalibrationReader()
+
+
+def quantize(weights_path, calibration_paths, imgsz=640, per_channel=False):
+    """用校准图像静态量化FP32 ONNX模型，返回 (FP32路径, INT8路径)"""
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    fp32_path = export_onnx(weights_path, imgsz=imgsz)
+    int8_path = quantized_model_path(weights_path)
+    input_name = OnnxYOLO(fp32_path).input_name
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        prepared_path = os.path.join(tmp_dir, "prepared.onnx")
+        print(" 量化预处理 (shape inference / 图优化)...")
+        quant_pre_process(fp32_path, prepared_path)
+
+        print(f" 开始INT8校准: {len(calibration_paths)} 张图像")
+        quantize_static(
+            prepared_path,
+            int8_path,
+            make_calibration_reader(calibration_paths, input_name, imgsz),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=per_channel
+        )
+
+    print(f" INT8模型已保存: {int8_path}")
+    return fp32_path, int8_path
+
+
+def _top_detection(result):
+    """取置信度最高的检测 (class_id, confidence)，没有检测时返回 (None, 0.0)"""
+    boxes = result.boxes
+    if len(boxes) == 0:
+        return None, 0.0
+    idx = int(np.argmax(boxes.conf))
+    return int(boxes.cls[idx]), float(boxes.conf[idx])
+
+
+def _run_model(model, paths, predict_kwargs):
+    detections = []
+    latencies = []
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        start = time.perf_counter()
+        result = model(image, **predict_kwargs)[0]
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        detections.append((path, _top_detection(result)))
+    return detections, latencies
+
+
+def _latency_summary(latencies):
+    if not latencies:
+        return {"mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0}
+    values = np.array(latencies)
+    return {
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2)
+    }
+
+
+def compare_models(fp32_path, int8_path, paths, class_names, predict_kwargs):
+    """FP32 与 INT8 模型逐张对比，生成报告"""
+    fp32_model = OnnxYOLO(fp32_path)
+    int8_model = OnnxYOLO(int8_path)
+
+    # 各跑一张预热，避免首次推理的初始化开销计入延迟
+    if paths:
+        for model in (fp32_model, int8_model):
+            model(cv2.imread(paths[0]), **predict_kwargs)
+
+    fp32_detections, fp32_latencies = _run_model(fp32_model, paths, predict_kwargs)
+    int8_detections, int8_latencies = _run_model(int8_model, paths, predict_kwargs)
+
+    per_class = {
+        name: {"fp32_count": 0, "int8_count": 0, "agree": 0, "drift": []}
+        for name in class_names + ["none"]
+    }
+    changed = []
+
+    for (path, (fp32_cls, fp32_conf)), (_, (int8_cls, int8_conf)) in zip(fp32_detections, int8_detections):
+        fp32_name = class_names[fp32_cls] if fp32_cls is not None else "none"
+        int8_name = class_names[int8_cls] if int8_cls is not None else "none"
+        per_class[fp32_name]["fp32_count"] += 1
+        per_class[int8_name]["int8_count"] += 1
+
+        if fp32_name == int8_name:
+            per_class[fp32_name]["agree"] += 1
+            if fp32_cls is not None:
+                per_class[fp32_name]["drift"].append(int8_conf - fp32_conf)
+        else:
+            changed.append({
+                "image": path,
+                "fp32": {"class_name": fp32_name, "confidence": round(fp32_conf, 4)},
+                "int8": {"class_name": int8_name, "confidence": round(int8_conf, 4)}
+            })
+
+    classes = {}
+    for name, stats in per_class.items():
+        drift = np.array(stats["drift"]) if stats["drift"] else np.zeros(0)
+        classes[name] = {
+            "fp32_count": stats["fp32_count"],
+            "int8_count": stats["int8_count"],
+            "agreement": round(stats["agree"] / stats["fp32_count"], 4) if stats["fp32_count"] else None,
+            "mean_confidence_drift": round(float(drift.mean()), 4) if len(drift) else None,
+            "mean_abs_confidence_drift": round(float(np.abs(drift).mean()), 4) if len(drift) else None
+        }
+
+    total = len(fp32_detections)
+    agreed = sum(stats["agree"] for stats in per_class.values())
+    fp32_latency = _latency_summary(fp32_latencies)
+    int8_latency = _latency_summary(int8_latencies)
+
+    return {
+        "images": total,
+        "predict_kwargs": predict_kwargs,
+        "overall_agreement": round(agreed / total, 4) if total else None,
+        "classes": classes,
+        "latency": {
+            "fp32": fp32_latency,
+            "int8": int8_latency,
+            "speedup": round(fp32_latency["mean_ms"] / int8_latency["mean_ms"], 2) if int8_latency["mean_ms"] else None
+        },
+        "model_size_mb": {
+            "fp32": round(os.path.getsize(fp32_path) / 1024 / 1024, 2),
+            "int8": round(os.path.getsize(int8_path) / 1024 / 1024, 2)
+        },
+        "changed_predictions": changed
+    }
+
+
+def print_report(report):
+    print("=" * 72)
+    print(f" FP32 vs INT8 对比 - {report['images']} 张图像, 总体一致率: {report['overall_agreement']}")
+    print("-" * 72)
+    print(f" {'类别':<28}{'FP32':>6}{'INT8':>6}{'一致率':>10}{'置信度漂移':>12}")
+    for name, stats in report["classes"].items():
+        agreement = "-" if stats["agreement"] is None else f"{stats['agreement']:.2%}"
+        drift = "-" if stats["mean_confidence_drift"] is None else f"{stats['mean_confidence_drift']:+.4f}"
+        print(f" {name:<28}{stats['fp32_count']:>6}{stats['int8_count']:>6}{agreement:>10}{drift:>12}")
+    print("-" * 72)
+    latency = report["latency"]
+    print(f" 延迟 FP32: {latency['fp32']['mean_ms']}ms (p95 {latency['fp32']['p95_ms']}ms)")
+    print(f" 延迟 INT8: {latency['int8']['mean_ms']}ms (p95 {latency['int8']['p95_ms']}ms), 加速 {latency['speedup']}x")
+    print(f" 模型大小: FP32 {report['model_size_mb']['fp32']}MB, INT8 {report['model_size_mb']['int8']}MB")
+    print("=" * 72)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="YOLO模型INT8静态量化并生成精度对比报告")
+    parser.add_argument("--images", required=True, help="校准/评估图像目录")
+    parser.add_argument("--weights", default=DEFAULT_WEIGHTS, help="best.pt 路径")
+    parser.add_argument("--config", default=DEFAULT_CONFIG, help="yolo_config.yaml 路径（类别名）")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--limit", type=int, default=None, help="最多使用多少张校准图像")
+    parser.add_argument("--per-channel", action="store_true", help="按通道量化权重（精度更高，速度略慢）")
+    parser.add_argument("--conf", type=float, default=0.001, help="对比时使用的置信度阈值")
+    parser.add_argument("--iou", type=float, default=0.05, help="对比时使用的NMS IoU阈值")
+    parser.add_argument("--report", default=None, help="报告输出路径，默认 best.int8.report.json")
+    args = parser.parse_args(argv)
+
+    paths = list_images(args.images, args.limit)
+    if not paths:
+        parser.error(f"目录中没有图像: {args.images}")
+
+    class_names = load_class_names(args.config)
+    fp32_path, int8_path = quantize(args.weights, paths, imgsz=args.imgsz, per_channel=args.per_channel)
+
+    predict_kwargs = {"conf": args.conf, "iou": args.iou, "imgsz": args.imgsz, "max_det": 10}
+    report = compare_models(fp32_path, int8_path, paths, class_names, predict_kwargs)
+    print_report(report)
+
+    report_path = args.report or os.path.splitext(int8_path)[0] + ".report.json"
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f" 报告已保存: {report_path}")
+
+
+if __name__ == "__main__":
+    main()
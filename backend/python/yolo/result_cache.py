@@ -0,0 +1,165 @@
+﻿import atexit
+import copy
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_cache_key(image_bytes, model_version, params):
+    """内容寻址的缓存键: 图像字节 + 模型版本 + 推理参数"""
+    digest = hashlib.sha256(image_bytes)
+    digest.update(model_version.encode("utf-8"))
+    digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    检测结果的LRU缓存（带条目上限和过期时间）
+    persist_path 不为空时同时写入SQLite文件，重启后自动加载未过期的条目；
+    磁盘写入由后台线程批量提交，请求线程不等待磁盘，也不在持有锁时访问数据库，
+    写入失败（如多个worker同时写入时 database is locked）只计数，不影响已经得到的检测结果
+    """
+
+    def __init__(self, max_entries=256, ttl=3600, persist_path=None, max_pending_writes=1000):
+        self.max_entries = int(max_entries)
+        self.ttl = float(ttl)
+        self.persist_path = persist_path
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "persist_errors": 0, "persist_dropped": 0}
+        self._db = None
+        self._writes = queue.Queue(maxsize=int(max_pending_writes))
+
+        if persist_path:
+            self._open_store()
+            threading.Thread(target=self._run_writer, name="result-cache-writer", daemon=True).start()
+            atexit.register(self.close)
+
+    def get(self, key):
+        """命中时返回结果的副本，未命中或已过期返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+
+            created_at, result = entry
+            if time.time() - created_at > self.ttl:
+                del self._entries[key]
+                self._delete_stored(key)
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return copy.deepcopy(result)
+
+    def put(self, key, result):
+        if self.max_entries <= 0:
+            return
+        created_at = time.time()
+        result = copy.deepcopy(result)
+        stored = json.dumps(result, ensure_ascii=False) if self._db is not None else None
+
+        with self._lock:
+            self._entries[key] = (created_at, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self._delete_stored(old_key)
+                self._stats["evictions"] += 1
+
+            self._queue_write(("put", key, created_at, stored))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["max_entries"] = self.max_entries
+        stats["ttl"] = self.ttl
+        stats["persistent"] = self.persist_path is not None
+        return stats
+
+    def _open_store(self):
+        """打开持久化文件，并把未过期的最新条目加载到内存"""
+        directory = os.path.dirname(os.path.abspath(self.persist_path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._db = sqlite3.connect(self.persist_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS result_cache ("
+            "key TEXT PRIMARY KEY, created_at REAL NOT NULL, result TEXT NOT NULL)"
+        )
+        self._db.execute("DELETE FROM result_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        self._db.commit()
+
+        rows = self._db.execute(
+            "SELECT key, created_at, result FROM result_cache ORDER BY created_at DESC LIMIT ?",
+            (self.max_entries,)
+        ).fetchall()
+        for key, created_at, result in reversed(rows):
+            self._entries[key] = (created_at, json.loads(result))
+        print(f" 结果缓存已从磁盘加载 {len(rows)} 条: {self.persist_path}")
+
+    def close(self):
+        """写完排队中的磁盘写入后停止后台线程"""
+        if self._db is None:
+            return
+        self._writes.put(None)
+        self._writes.join()
+        self._db.close()
+        self._db = None
+
+    def _delete_stored(self, key):
+        self._queue_write(("delete", key))
+
+    def _queue_write(self, operation):
+        """放入后台写入队列（调用方可能持有 self._lock，这里不阻塞）；队列已满时丢弃，只影响重启后的缓存"""
+        if self._db is None:
+            return
+        try:
+            self._writes.put_nowait(operation)
+        except queue.Full:
+            self._stats["persist_dropped"] += 1
+
+    def _run_writer(self):
+        """后台线程：把队列中已有的写入合并到一个事务中提交"""
+        while True:
+            operation = self._writes.get()
+            batch = [operation]
+            while operation is not None:
+                try:
+                    operation = self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(operation)
+
+            operations = [op for op in batch if op is not None]
+            try:
+                with self._db:
+                    for op in operations:
+                        if op[0] == "put":
+                            self._db.execute(
+                                "INSERT OR REPLACE INTO result_cache (key, created_at, result) VALUES (?, ?, ?)",
+                                op[1:]
+                            )
+                        else:
+                            self._db.execute("DELETE FROM result_cache WHERE key = ?", (op[1],))
+            except sqlite3.Error as e:
+                with self._lock:
+                    self._stats["persist_errors"] += len(operations)
+                print(f" 结果缓存写入磁盘失败 ({len(operations)} 条): {e}")
+            for _ in batch:
+                self._writes.task_done()
+            if batch[-1] is None:
+                return
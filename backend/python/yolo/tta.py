@@ -0,0 +1,232 @@
+﻿import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image, ImageEnhance, ImageOps
+
+from .detector import to_numpy
+
+# 默认增强: 水平翻转、缩小两档（与ultralytics augment=True 的尺度相同）、提亮；原图总是第一个视图
+DEFAULT_AUGMENTATIONS = "hflip,scale:0.83,scale:0.67,jitter:1.2"
+
+
+class TTABoxes:
+    """融合后的检测框（numpy数组），接口与ultralytics Boxes的 xyxy/conf/cls 相同"""
+
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+
+    def __len__(self):
+        return len(self.conf)
+
+
+class TTAResult:
+    def __init__(self, boxes, orig_shape, names, tta_info):
+        self.boxes = boxes
+        self.orig_shape = orig_shape
+        self.names = names
+        self.tta_info = tta_info
+
+
+def parse_augmentations(spec):
+    """"hflip,scale:0.83,jitter:1.2" -> [("identity", None), ("hflip", None), ("scale", 0.83), ("jitter", 1.2)]"""
+    augmentations = [("identity", None)]
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item or item == "identity":
+            continue
+        name, _, value = item.partition(":")
+        if name not in ("hflip", "vflip", "scale", "jitter"):
+            raise ValueError(f"未知的增强方式: {item}")
+        augmentations.append((name, float(value) if value else None))
+    return augmentations
+
+
+def augment(image, name, value):
+    """
+    生成一个增强视图，返回 (视图图像, 把视图中的框映射回原图坐标的函数)
+    所有视图与原图尺寸相同，可以放进同一批推理
+    """
+    width, height = image.size
+    if name == "hflip":
+        def inverse(xyxy):
+            return np.stack([width - xyxy[:, 2], xyxy[:, 1], width - xyxy[:, 0], xyxy[:, 3]], axis=1)
+        return ImageOps.mirror(image), inverse
+    if name == "vflip":
+        def inverse(xyxy):
+            return np.stack([xyxy[:, 0], height - xyxy[:, 3], xyxy[:, 2], height - xyxy[:, 1]], axis=1)
+        return ImageOps.flip(image), inverse
+    if name == "scale" and value < 1:
+        # 缩小后居中放在灰色画布上：目标在模型输入中变小
+        size = (max(1, round(width * value)), max(1, round(height * value)))
+        offset = ((width - size[0]) // 2, (height - size[1]) // 2)
+        canvas = Image.new("RGB", (width, height), (114, 114, 114))
+        canvas.paste(image.resize(size, Image.BILINEAR), offset)
+        def inverse(xyxy):
+            return (xyxy - np.array([offset[0], offset[1], offset[0], offset[1]])) / value
+        return canvas, inverse
+    if name == "scale" and value > 1:
+        # 裁剪中心区域再放大：目标在模型输入中变大
+        crop_w, crop_h = width / value, height / value
+        left, top = (width - crop_w) / 2, (height - crop_h) / 2
+        view = image.resize((width, height), Image.BILINEAR, box=(left, top, left + crop_w, top + crop_h))
+        def inverse(xyxy):
+            return xyxy / value + np.array([left, top, left, top])
+        return view, inverse
+    if name == "jitter":
+        view = ImageEnhance.Contrast(ImageEnhance.Brightness(image).enhance(value)).enhance(value)
+        return view, lambda xyxy: xyxy
+    return image, lambda xyxy: xyxy
+
+
+def box_iou(box, boxes):
+    """一个框与多个框的IoU"""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return intersection / np.maximum(area + areas - intersection, 1e-9)
+
+
+def weighted_boxes_fusion(predictions, num_views, iou_thr=0.55):
+    """
+    加权框融合 (WBF)：所有视图的同类检测框按置信度从高到低聚类（与聚类融合框IoU>iou_thr），
+    融合框坐标为置信度加权平均，置信度为平均置信度 × min(框数, 视图数) / 视图数，
+    只在少数视图中出现的框置信度会被降低
+    predictions: [(xyxy, conf, cls)]，每个视图一项，坐标已映射回原图
+    """
+    xyxy = np.concatenate([p[0] for p in predictions]).reshape(-1, 4).astype(np.float32)
+    conf = np.concatenate([p[1] for p in predictions]).astype(np.float32)
+    cls = np.concatenate([p[2] for p in predictions]).astype(np.float32)
+    if len(conf) == 0:
+        return np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.float32)
+
+    clusters = []  # [类别, 成员下标列表]，融合框在 fused_boxes 的同一行
+    fused_boxes = np.zeros((0, 4), np.float32)
+    fused_cls = np.zeros(0, np.float32)
+    for index in np.argsort(-conf):
+        match = -1
+        candidates = np.where(fused_cls == cls[index])[0]
+        if len(candidates):
+            ious = box_iou(xyxy[index], fused_boxes[candidates])
+            best = int(np.argmax(ious))
+            if ious[best] > iou_thr:
+                match = int(candidates[best])
+        if match < 0:
+            clusters.append([cls[index], [index]])
+            fused_boxes = np.vstack([fused_boxes, xyxy[index]])
+            fused_cls = np.append(fused_cls, cls[index])
+            continue
+        members = clusters[match][1]
+        members.append(index)
+        weights = conf[members]
+        fused_boxes[match] = (xyxy[members] * weights[:, None]).sum(axis=0) / weights.sum()
+
+    fused_conf = np.array([
+        conf[members].mean() * min(len(members), num_views) / num_views for _, members in clusters
+    ], dtype=np.float32)
+    order = np.argsort(-fused_conf)
+    return fused_boxes[order], fused_conf[order], fused_cls[order]
+
+
+class TTAEngine:
+    """
+    测试时增强 (TTA)：原图和配置的增强视图（翻转、缩放、颜色抖动）放在同一批中推理一次，
+    各视图的检测框映射回原图坐标后用加权框融合合并
+    按最近的单视图推理耗时估算成本，超出每个请求的预算 budget_ms 时减少视图数，
+    并发请求多（负载高）时视图数随之减少，最少只推理原图（即关闭TTA）
+    调用方式与 ultralytics.YOLO 相同，返回 [TTAResult]
+    """
+
+    def __init__(self, model, augmentations=None, budget_ms=None, iou_thr=0.55):
+        self.model = model
+        self.augmentations = parse_augmentations(
+            augmentations if augmentations is not None else os.environ.get("YOLO_TTA_AUGMENTATIONS", DEFAULT_AUGMENTATIONS)
+        )
+        self.budget_ms = float(budget_ms if budget_ms is not None else os.environ.get("YOLO_TTA_BUDGET_MS", 1500))
+        self.iou_thr = iou_thr
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._calls = 0
+        self._view_ms = None
+        self._stats = {"requests": 0, "views": 0, "reduced": 0, "disabled": 0}
+
+    def plan(self, budget_ms=None):
+        """按预算和当前并发数决定本次推理的视图数"""
+        budget = self.budget_ms if budget_ms is None else budget_ms
+        with self._lock:
+            if self._view_ms is None:
+                return len(self.augmentations)
+            cost = self._view_ms * max(1, self._in_flight)
+        return max(1, min(len(self.augmentations), int(budget // cost) if cost > 0 else len(self.augmentations)))
+
+    def __call__(self, image, budget_ms=None, **predict_kwargs):
+        predict_kwargs.pop("augment", None)
+        image = image if image.mode == "RGB" else image.convert("RGB")
+
+        with self._lock:
+            self._in_flight += 1
+        try:
+            count = self.plan(budget_ms)
+            augmentations = self.augmentations[:count]
+            views = [augment(image, name, value) for name, value in augmentations]
+
+            start = time.perf_counter()
+            results = self.model([view for view, _ in views], **predict_kwargs)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+        predictions = []
+        for (_, inverse), result in zip(views, results):
+            boxes = result.boxes
+            if boxes is None or len(boxes) == 0:
+                continue
+            xyxy = inverse(to_numpy(boxes.xyxy).reshape(-1, 4))
+            predictions.append((xyxy, to_numpy(boxes.conf), to_numpy(boxes.cls)))
+
+        width, height = image.size
+        if predictions:
+            xyxy, conf, cls = weighted_boxes_fusion(predictions, len(views), self.iou_thr)
+            xyxy = np.clip(xyxy, 0, [width, height, width, height])
+        else:
+            xyxy, conf, cls = np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.float32)
+
+        self._record(len(views), elapsed_ms)
+        info = {
+            "views": [name if value is None else f"{name}:{value:g}" for name, value in augmentations],
+            "skipped": len(self.augmentations) - len(views),
+            "ms": round(elapsed_ms, 1)
+        }
+        return [TTAResult(TTABoxes(xyxy, conf, cls), (height, width), getattr(results[0], "names", None), info)]
+
+    def _record(self, views, elapsed_ms):
+        with self._lock:
+            self._calls += 1
+            # 第一次调用包含模型加载和初始化，不计入耗时估计
+            if self._calls > 1:
+                view_ms = elapsed_ms / views
+                self._view_ms = view_ms if self._view_ms is None else 0.7 * self._view_ms + 0.3 * view_ms
+            self._stats["requests"] += 1
+            self._stats["views"] += views
+            if views == 1 and len(self.augmentations) > 1:
+                self._stats["disabled"] += 1
+            elif views < len(self.augmentations):
+                self._stats["reduced"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["view_ms"] = round(self._view_ms, 1) if self._view_ms is not None else None
+            stats["in_flight"] = self._in_flight
+        stats["augmentations"] = len(self.augmentations)
+        stats["budget_ms"] = self.budget_ms
+        return stats
@@ -0,0 +1,52 @@
+﻿"""
+Gunicorn预加载(pre-fork)部署配置
+
+    gunicorn -c gunicorn.conf.py app:app
+
+- preload_app: app.py 在主进程中导入，模型权重只加载一次，fork后的worker以写时复制方式共享
+- 每个worker的推理线程数 = CPU核数 / worker数，避免多个worker争抢同一批核心
+- 批处理队列、结果缓存、预热线程在 post_fork 里为每个worker单独创建（线程不会跨fork保留）
+- 查看共享/私有内存: python backend/python/memory_report.py <主进程PID>
+
+环境变量: WEB_CONCURRENCY (worker数), GUNICORN_THREADS (每个worker的请求线程数),
+YOLO_NUM_THREADS (每个worker的推理线程数), PORT
+"""
+import gc
+import os
+import sys
+
+cpu_count = os.cpu_count() or 1
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", max(1, cpu_count // 2)))
+# 批处理队列和SSE长连接需要多线程worker
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+preload_app = True
+# 首次推理前worker要先预热，放宽超时
+timeout = 120
+
+intra_op_threads = int(os.environ.get("YOLO_NUM_THREADS", max(1, cpu_count // workers)))
+
+# 必须在主进程导入torch/onnxruntime之前设置，fork出的worker会继承
+os.environ["CATHEALTH_PREFORK"] = "1"
+os.environ["YOLO_NUM_THREADS"] = str(intra_op_threads)
+for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+    os.environ.setdefault(name, str(intra_op_threads))
+
+
+def when_ready(server):
+    # 预加载完成、第一次fork之前冻结GC：已有对象移出GC跟踪，
+    # worker里的垃圾回收不再改写这些对象的头部，共享页面不会因此被复制
+    gc.freeze()
+    server.log.info(f"预加载完成: {workers} 个worker, 每个worker推理线程数 {intra_op_threads}")
+
+
+def post_fork(server, worker):
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(intra_op_threads)
+    if "cv2" in sys.modules:
+        sys.modules["cv2"].setNumThreads(intra_op_threads)
+
+    # 预加载的 app 模块已在主进程导入，这里只为当前worker创建线程和连接
+    sys.modules["app"].start_inference_services()
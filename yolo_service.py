@@ -1,12 +1,11 @@
 ﻿from flask import Flask, request, jsonify
 from flask_cors import CORS
-from ultralytics import YOLO
-import cv2
 import numpy as np
 from PIL import Image
 import io
 import os
 import random
+import threading
 
 app = Flask(__name__)
 CORS(app)
@@ -38,20 +37,31 @@ RECOMMENDATIONS = {
     "parasitic infection": "检测到可能寄生虫感染，风险高但治愈率高。建议立即就医进行专业检查，按时驱虫，隔离其他宠物。"
 }
 
-# 加载模型
+# 模型在第一次分析请求时才加载（导入ultralytics/torch需要好几秒，启动和 /health 不等待）
+model_path = "best.pt"
 model = None
-try:
-    model_path = "best.pt"
-    if os.path.exists(model_path):
-        print(f" 加载YOLOv8模型: {model_path}")
-        model = YOLO(model_path)
-        print(" 模型加载成功!")
-    else:
-        print(f" 模型文件不存在: {model_path}")
-        model = None
-except Exception as e:
-    print(f" 模型加载失败: {e}")
-    model = None
+model_load_attempted = False
+model_lock = threading.Lock()
+
+def get_model():
+    """返回YOLOv8模型，首次调用时加载；加载失败返回 None，之后不再重试"""
+    global model, model_load_attempted
+    if model_load_attempted:
+        return model
+    with model_lock:
+        if not model_load_attempted:
+            try:
+                if os.path.exists(model_path):
+                    print(f" 加载YOLOv8模型: {model_path}")
+                    from ultralytics import YOLO
+                    model = YOLO(model_path)
+                    print(" 模型加载成功!")
+                else:
+                    print(f" 模型文件不存在: {model_path}")
+            except Exception as e:
+                print(f" 模型加载失败: {e}")
+            model_load_attempted = True
+    return model
 
 @app.route("/api/ai/analyze", methods=["POST"])
 def analyze_image():
@@ -68,7 +78,7 @@ def analyze_image():
         image = Image.open(io.BytesIO(image_data))
         
         # 如果模型未加载，使用模拟分析
-        if model is None:
+        if get_model() is None:
             print(" 使用模拟分析（模型未加载）")
             result = simulate_yolo_analysis()
         else:
@@ -183,7 +193,7 @@ def simulate_yolo_analysis():
 
 @app.route("/health", methods=["GET"])
 def health_check():
-    model_status = "loaded" if model else "failed"
+    model_status = "loaded" if model else ("failed" if model_load_attempted else "not_loaded")
     return jsonify({
         "status": "healthy", 
         "service": "CatHealth YOLOv8 AI Service",
@@ -1,24 +1,36 @@
 ﻿from flask import Flask, request, jsonify
 from flask_cors import CORS
-from ultralytics import YOLO
-import cv2
 import numpy as np
 from PIL import Image
 import io
 import os
 import random
+import threading
 
 app = Flask(__name__)
 CORS(app)
 
-# 加载YOLOv8模型
-print("🔬 加载YOLOv8模型...")
-try:
-    model = YOLO("best.pt")  # 使用你训练好的模型
-    print("✅ 模型加载成功!")
-except Exception as e:
-    print(f"❌ 模型加载失败: {e}")
-    model = None
+# YOLOv8模型在第一次分析请求时才加载（导入ultralytics/torch需要好几秒，启动和 /health 不等待）
+model = None
+model_load_attempted = False
+model_lock = threading.Lock()
+
+def get_model():
+    """返回YOLOv8模型，首次调用时加载；加载失败返回 None，之后不再重试"""
+    global model, model_load_attempted
+    if model_load_attempted:
+        return model
+    with model_lock:
+        if not model_load_attempted:
+            print("🔬 加载YOLOv8模型...")
+            try:
+                from ultralytics import YOLO
+                model = YOLO("best.pt")  # 使用你训练好的模型
+                print("✅ 模型加载成功!")
+            except Exception as e:
+                print(f"❌ 模型加载失败: {e}")
+            model_load_attempted = True
+    return model
 
 # 症状映射
 SYMPTOM_MAPPING = {
@@ -65,7 +77,7 @@ def analyze_image():
         image_data = file.read()
         image = Image.open(io.BytesIO(image_data))
         
-        if model is None:
+        if get_model() is None:
             return jsonify({"success": False, "error": "YOLOv8模型未加载"})
         
         # 使用YOLOv8模型进行真实分析
@@ -176,7 +188,7 @@ def test_analysis():
 @app.route("/api/health", methods=["GET"])
 def health_check():
     """健康检查"""
-    model_status = "loaded" if model else "failed"
+    model_status = "loaded" if model else ("failed" if model_load_attempted else "not_loaded")
     return jsonify({
         "status": "healthy", 
         "service": "CatHealth YOLOv8 AI Service",